@@ -1,4 +1,5 @@
 import random
+from cave_grid import CaveGrid, WALL, FLOOR
 
 width = 95
 height = 35
@@ -10,17 +11,15 @@ drunk = {
     'y': int( height / 2 )
 }
 
-def getLevelRow():
-    return ['#'] * width
-
-level = [getLevelRow() for _ in range(height)]
+# one byte per cell, turned into text only when printed
+level = CaveGrid.walls(width, height)
 
 while drunk['wallCountdown'] >= 0:
     x = drunk['x']
     y = drunk['y']
     
-    if level[y][x] == '#':
-        level[y][x] = ' '
+    if level[y, x] == WALL:
+        level[y, x] = FLOOR
         drunk['wallCountdown'] -= 1
     
     roll = random.randint(1, 4)
@@ -37,5 +36,4 @@ while drunk['wallCountdown'] >= 0:
     if roll == 4 and y < height - 1 - drunk['padding']:
         drunk['y'] += 1
 
-for row in level:
-    print( ''.join(row) )
+print( level.toText(floor=' ') )
@@ -0,0 +1,80 @@
+### Batched Breadth-First Search: a whole stack of levels per step
+#
+# getShortestPath searches one level at a time in Python. Here every level of
+# a stack (N, height, width), WALL / FLOOR as in cave_grid, advances its BFS
+# frontier together: one step is "neighbours of the frontier, on open floor,
+# not seen before", done with shifts of the levels' rows packed into 64 bit
+# words (row_bits.py). A level drops out as soon as its end is reached or its
+# frontier runs dry, so the step count is the longest path still searched
+# and the per-step work shrinks as levels finish.
+#
+# Lengths count cells like len(getShortestPath(...)): start and end
+# included, 0 when the end can't be reached.
+
+import numpy as np
+from cave_grid import FLOOR
+from row_bits import packRows, unpackRows, testBits, neighbours
+
+
+def batchedShortestPaths(levels, starts, ends=None, returnDistances=False):
+    # levels: (N, height, width); starts / ends: (N, 2) [x, y]
+    # -> path length per level, and with returnDistances the (N, height,
+    # width) int32 distance fields too (-1 = unreachable). Distance fields
+    # cover the whole level, so ends are optional then.
+    levels = np.asarray(levels)
+    n, height, width = levels.shape
+    starts = np.asarray(starts).reshape(n, 2)
+    if ends is None and not returnDistances:
+        raise ValueError('batchedShortestPaths needs ends unless returnDistances is set')
+
+    floor = levels == FLOOR
+    openBits = packRows(floor)
+    seeds = np.zeros_like(floor)
+    seeds[np.arange(n), starts[:, 1], starts[:, 0]] = True
+    frontier = packRows(seeds & floor)
+    del seeds
+
+    lengths = np.zeros(n, dtype=np.int64)
+    distances = None
+    if returnDistances:
+        distances = np.full((n, height, width), -1, dtype=np.int32)
+        distances[np.arange(n), starts[:, 1], starts[:, 0]] = np.where(floor[np.arange(n), starts[:, 1], starts[:, 0]], 0, -1)
+    del floor
+
+    active = np.arange(n)
+    if ends is not None:
+        ends = np.asarray(ends).reshape(n, 2)
+        endXs, endYs = ends[:, 0].copy(), ends[:, 1].copy()
+    seen = frontier.copy()
+    step = 0
+
+    while len(active):
+        if ends is not None:
+            # an end is found the step its cell joins the frontier
+            found = (lengths[active] == 0) & testBits(frontier, endXs, endYs)
+            lengths[active[found]] = step + 1
+        else:
+            found = np.zeros(len(active), dtype=bool)
+
+        step += 1
+        frontier = neighbours(frontier) & openBits & ~seen
+        seen |= frontier
+        if returnDistances:
+            reached = unpackRows(frontier, width)
+            layer = np.nonzero(reached)
+            distances[active[layer[0]], layer[1], layer[2]] = step
+
+        # drop levels whose search is over: the frontier ran dry, or the end
+        # was found and nobody wants the rest of the distance field
+        finished = ~frontier.any(axis=(1, 2))
+        if not returnDistances:
+            finished |= found
+        if finished.any():
+            keep = ~finished
+            active, frontier, seen, openBits = active[keep], frontier[keep], seen[keep], openBits[keep]
+            if ends is not None:
+                endXs, endYs = endXs[keep], endYs[keep]
+
+    if returnDistances:
+        return lengths, distances
+    return lengths
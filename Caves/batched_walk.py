@@ -0,0 +1,57 @@
+### Batched Drunken Walk: many levels at once with NumPy
+#
+# Same walk as drunkenWalkGenerator in mid_level_cave_system_BFS.py: every
+# walker starts in the middle of its own level, carves the wall it stands on,
+# then rolls left / right / up / down and moves unless that would enter the
+# padding, until removeBlocks + 1 cells are open. Here the N walkers advance
+# together, one vectorized step at a time, with their rolls drawn in blocks of
+# BLOCK_STEPS; walkers that used up their budget drop out between blocks.
+#
+# Levels come back as one uint8 array (N, height, width), WALL / FLOOR as in
+# cave_grid (CaveGrid(levels[i]) wraps one), with the start and end [x, y] of
+# each walk. The same seed gives the same levels.
+
+import numpy as np
+from cave_grid import WALL, FLOOR
+
+# rolls drawn per walker at a time
+BLOCK_STEPS = 256
+
+
+def batchedDrunkenWalk(amount, levelWidth, levelHeight, removeBlocks, padding=2, seed=None):
+    rng = np.random.default_rng(seed)
+    levels = np.full((amount, levelHeight, levelWidth), WALL, dtype=np.uint8)
+    cells = levels.reshape(amount, -1)
+
+    startX, startY = int(levelWidth / 2), int(levelHeight / 2)
+    starts = np.tile(np.array([startX, startY], dtype=np.int64), (amount, 1))
+    ends = starts.copy()
+
+    # state of the walkers still carving
+    walkers = np.arange(amount)
+    xs = np.full(amount, startX, dtype=np.int64)
+    ys = np.full(amount, startY, dtype=np.int64)
+    budgets = np.full(amount, removeBlocks, dtype=np.int64)
+    low, highX, highY = padding, levelWidth - 1 - padding, levelHeight - 1 - padding
+
+    while len(walkers):
+        rolls = rng.integers(0, 4, size=(BLOCK_STEPS, len(walkers)), dtype=np.uint8)
+        for roll in rolls:
+            carving = budgets >= 0
+            positions = ys * levelWidth + xs
+            wall = (cells[walkers, positions] == WALL) & carving
+            cells[walkers[wall], positions[wall]] = FLOOR
+            budgets -= wall
+
+            # the end is the last cell carved, before the final move
+            finished = carving & (budgets < 0)
+            if finished.any():
+                ends[walkers[finished], 0] = xs[finished]
+                ends[walkers[finished], 1] = ys[finished]
+
+            xs = xs - ((roll == 0) & (xs > low)) + ((roll == 1) & (xs < highX))
+            ys = ys - ((roll == 2) & (ys > low)) + ((roll == 3) & (ys < highY))
+        # finished walkers idle until the end of the block, then drop out
+        keep = budgets >= 0
+        walkers, xs, ys, budgets = walkers[keep], xs[keep], ys[keep], budgets[keep]
+    return levels, starts, ends
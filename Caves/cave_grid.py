@@ -0,0 +1,85 @@
+### Cave Grid: a level as one uint8 array
+#
+# The scripts keep a level as a list of lists of characters or ints, tens of
+# bytes per cell. CaveGrid keeps one byte per cell (WALL / FLOOR) in a NumPy
+# array, or one bit per cell when packed, and only turns into text, rows or
+# LED digits when it is printed.
+#
+#   grid = CaveGrid.walls(levelWidth, levelHeight)
+#   grid[y, x] = FLOOR
+#   print(grid.toText())                 # '#' and '.'
+#   print(grid.toText(wall='1', floor='0'))  # the LED matrix digits
+#   packed = grid.packed()               # bytes: 1 bit per cell
+
+import numpy as np
+
+WALL = 1
+FLOOR = 0
+
+
+class CaveGrid:
+    def __init__(self, cells):
+        # cells: (height, width) array of WALL / FLOOR, used as is when uint8
+        self.cells = np.asarray(cells, dtype=np.uint8)
+
+    @classmethod
+    def walls(cls, width, height):
+        return cls(np.full((height, width), WALL, dtype=np.uint8))
+
+    @classmethod
+    def fromRows(cls, rows, wall='#'):
+        # the scripts' lists of characters (or ints, with wall=1)
+        return cls(np.array([[cell == wall for cell in row] for row in rows], dtype=np.uint8))
+
+    @classmethod
+    def fromBuffer(cls, buffer, width, height):
+        # a bytes / bytearray of width * height cells, without copying
+        return cls(np.frombuffer(buffer, dtype=np.uint8).reshape(height, width))
+
+    @classmethod
+    def fromPacked(cls, packed, width, height):
+        bits = np.unpackbits(np.frombuffer(packed, dtype=np.uint8).reshape(height, -1), axis=1, count=width)
+        return cls(bits)
+
+    @property
+    def width(self):
+        return self.cells.shape[1]
+
+    @property
+    def height(self):
+        return self.cells.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.cells.nbytes
+
+    def __getitem__(self, index):
+        return self.cells[index]
+
+    def __setitem__(self, index, value):
+        self.cells[index] = value
+
+    def __eq__(self, other):
+        return isinstance(other, CaveGrid) and np.array_equal(self.cells, other.cells)
+
+    def isWall(self, x, y):
+        return self.cells[y, x] == WALL
+
+    def openCells(self):
+        return int(self.cells.size - np.count_nonzero(self.cells))
+
+    def packed(self):
+        # rows padded to whole bytes, so each row starts on a byte
+        return np.packbits(self.cells, axis=1).tobytes()
+
+    def toText(self, wall='#', floor='.'):
+        # one line per row; built as a single byte array, not cell by cell
+        chars = np.array([ord(floor), ord(wall)], dtype=np.uint8)[self.cells]
+        lines = np.empty((self.height, self.width + 1), dtype=np.uint8)
+        lines[:, :-1] = chars
+        lines[:, -1] = ord('\n')
+        return lines.tobytes()[:-1].decode('ascii')
+
+    def toRows(self, wall='#', floor='.'):
+        # back to the scripts' list of lists of characters
+        return np.array([floor, wall])[self.cells].tolist()
@@ -0,0 +1,143 @@
+### Cave Scoring: many quality metrics for a whole stack of levels at once
+#
+# evaluateLevels ranks a level by one number, the BFS path length from start
+# to end. scoreLevels measures a stack of levels (N, height, width), WALL /
+# FLOOR as in cave_grid, with whole-array neighbour counts instead:
+#
+#   openRatio       floor cells / all cells
+#   deadEnds        floor cells with exactly one floor neighbour
+#   corridorWidth   mean passage width, floor cells per floor/wall edge pair
+#   chokepoints     floor cells whose neighbours only connect through them
+#   reachableArea   floor cells reachable from the start
+#
+# and combines them with per-metric weights into one score per level.
+#
+# reachableArea is a flood fill done on bitsets (row_bits.py): each row of
+# each level is packed into 64 bit words, and every round fills along whole
+# straight runs in all four directions (occluded fills), so the number of
+# rounds is the number of turns the flood needs, not its length.
+
+import numpy as np
+from cave_grid import FLOOR
+from row_bits import packRows, countBits, shiftRight, shiftLeft, shiftDown, shiftUp
+
+METRICS = ('openRatio', 'deadEnds', 'corridorWidth', 'chokepoints', 'reachableArea')
+
+# roomy caves with few dead ends and one-cell bottlenecks
+DEFAULT_WEIGHTS = {
+    'openRatio': 0.0,
+    'deadEnds': -1.0,
+    'corridorWidth': 10.0,
+    'chokepoints': -0.5,
+    'reachableArea': 0.1,
+}
+
+# levels per pass, keeps the temporaries in cache
+BATCH_LEVELS = 1024
+
+
+def _neighbours(floor):
+    # left, right, up, down floor neighbours, False off the edge
+    padded = np.pad(floor, ((0, 0), (1, 1), (1, 1)))
+    return (
+        padded[:, 1:-1, :-2], padded[:, 1:-1, 2:],
+        padded[:, :-2, 1:-1], padded[:, 2:, 1:-1],
+    ), padded
+
+
+def _chokepoints(floor, padded):
+    # Floor cells whose floor neighbours fall into 2+ groups around them:
+    # two side neighbours are linked when the corner between them is floor
+    # too, so groups = neighbours - links (1 if every link is there).
+    up, down = padded[:, :-2, 1:-1], padded[:, 2:, 1:-1]
+    left, right = padded[:, 1:-1, :-2], padded[:, 1:-1, 2:]
+    upLeft, upRight = padded[:, :-2, :-2], padded[:, :-2, 2:]
+    downLeft, downRight = padded[:, 2:, :-2], padded[:, 2:, 2:]
+    sides = up.astype(np.int8) + right + down + left
+    links = (
+        (up & upRight & right).astype(np.int8) + (right & downRight & down)
+        + (down & downLeft & left) + (left & upLeft & up)
+    )
+    groups = sides - links
+    return floor & (groups >= 2)
+
+
+def _fill(reached, passable, shift, length):
+    # occluded fill: everything reachable from `reached` by going straight in
+    # one direction through `passable`, in log2(length) shift steps
+    k = 1
+    while k < length:
+        reached = reached | (passable & shift(reached, k))
+        passable = passable & shift(passable, k)
+        k *= 2
+    return reached
+
+
+def _reachable(floor, starts):
+    # floor cells connected to starts[i] = [x, y], counted per level
+    n, height, width = floor.shape
+    openBits = packRows(floor)
+    seeds = np.zeros_like(floor)
+    seeds[np.arange(n), starts[:, 1], starts[:, 0]] = True
+    reached = packRows(seeds & floor)
+
+    counts = np.zeros(n, dtype=np.int64)
+    active = np.arange(n)
+    while len(active):
+        before = reached
+        reached = _fill(reached, openBits, shiftRight, width)
+        reached = _fill(reached, openBits, shiftLeft, width)
+        reached = _fill(reached, openBits, shiftDown, height)
+        reached = _fill(reached, openBits, shiftUp, height)
+        # levels that didn't grow are done; count them and drop them
+        growing = (reached != before).any(axis=(1, 2))
+        done = ~growing
+        if done.any():
+            counts[active[done]] = countBits(reached[done])
+            active, reached, openBits = active[growing], reached[growing], openBits[growing]
+    return counts
+
+
+def levelMetrics(levels, starts=None):
+    # levels: (N, height, width) WALL / FLOOR; starts: (N, 2) [x, y] the
+    # reachable area is measured from, default each level's first floor cell
+    levels = np.asarray(levels)
+    if levels.ndim == 2:
+        levels = levels[None]
+    n = len(levels)
+    if starts is None:
+        first = (levels.reshape(n, -1) == FLOOR).argmax(axis=1)
+        starts = np.stack([first % levels.shape[2], first // levels.shape[2]], axis=1)
+    starts = np.asarray(starts).reshape(n, 2)
+
+    metrics = {name: np.empty(n) for name in METRICS}
+    for begin in range(0, n, BATCH_LEVELS):
+        batch = slice(begin, begin + BATCH_LEVELS)
+        floor = levels[batch] == FLOOR
+        floorCells = floor.sum(axis=(1, 2))
+
+        (left, right, up, down), padded = _neighbours(floor)
+        sides = left.astype(np.int8) + right + up + down
+        # floor/wall edges, the level border counts as wall
+        wallEdges = (floor * (4 - sides)).sum(axis=(1, 2))
+
+        metrics['openRatio'][batch] = floorCells / floor[0].size
+        metrics['deadEnds'][batch] = (floor & (sides == 1)).sum(axis=(1, 2))
+        metrics['corridorWidth'][batch] = 2 * floorCells / np.maximum(wallEdges, 1)
+        metrics['chokepoints'][batch] = _chokepoints(floor, padded).sum(axis=(1, 2))
+        metrics['reachableArea'][batch] = _reachable(floor, starts[batch])
+    return metrics
+
+
+def scoreLevels(levels, weights=None, starts=None):
+    # -> (score per level, metrics); weights: metric name -> weight, missing
+    # metrics count 0
+    weights = DEFAULT_WEIGHTS if weights is None else weights
+    for name in weights:
+        if name not in METRICS:
+            raise ValueError("unknown metric '{}', use one of {}".format(name, ', '.join(METRICS)))
+    metrics = levelMetrics(levels, starts)
+    scores = np.zeros(len(metrics['openRatio']))
+    for name, weight in weights.items():
+        scores += weight * metrics[name]
+    return scores, metrics
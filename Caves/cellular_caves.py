@@ -0,0 +1,125 @@
+### Cellular Automata Caves: random fill + smoothing, many levels at once
+#
+# Every cell inside the padding starts as wall with chance fillRatio, then
+# each generation a cell becomes wall when WALL_RULE or more of the 3x3 block
+# around it are walls (cells off the level count as wall). The counts are
+# two shifted sums over the whole stack (N, height, width), rows then
+# columns, so a generation is a handful of array adds whatever the size.
+#
+# Smoothing leaves pockets of floor that can't be reached from each other;
+# only the largest one of each level is kept, the rest are walled up. The
+# start is the floor cell nearest the middle (where the walk starts) and the
+# end the floor cell farthest from it in a straight line.
+#
+# Levels come back like batchedDrunkenWalk's: uint8 (N, height, width),
+# WALL / FLOOR as in cave_grid, with the start and end [x, y] of each. The
+# same seed gives the same levels.
+
+import numpy as np
+from cave_grid import WALL, FLOOR
+
+FILL_RATIO = 0.45
+GENERATIONS = 5
+# walls in a cell's 3x3 block that make it a wall
+WALL_RULE = 5
+
+
+def smooth(walls, generations=GENERATIONS, padding=2):
+    # walls: uint8 (N, height, width), 1 = wall; the padding stays wall
+    n, height, width = walls.shape
+    outside = np.ones((height, width), dtype=bool)
+    outside[padding:height - padding, padding:width - padding] = False
+    walls = (walls.astype(bool) | outside).astype(np.uint8)
+    for _ in range(generations):
+        padded = np.pad(walls, ((0, 0), (1, 1), (1, 1)), constant_values=WALL)
+        rows = padded[:, :, :-2] + padded[:, :, 1:-1] + padded[:, :, 2:]
+        block = rows[:, :-2] + rows[:, 1:-1] + rows[:, 2:]
+        walls = ((block >= WALL_RULE) | outside).astype(np.uint8)
+    return walls
+
+
+def _runRegions(floor):
+    # Each row splits into runs of floor; two runs of neighbouring rows of
+    # the same level touch when one starts above or below the other, and
+    # every run takes the smallest run id of its region by repeated
+    # min-propagation over those links.
+    # -> run id per cell (meaningful on floor only), region id per run
+    runStarts = floor.copy()
+    runStarts[:, :, 1:] &= ~floor[:, :, :-1]
+    runs = np.cumsum(runStarts.ravel(), dtype=np.int32).reshape(floor.shape) - 1
+    runCount = int(runs[-1, -1, -1]) + 1
+
+    links = floor[:, :-1] & floor[:, 1:] & (runStarts[:, :-1] | runStarts[:, 1:])
+    above, below = runs[:, :-1][links], runs[:, 1:][links]
+
+    labels = np.arange(runCount, dtype=np.int32)
+    while True:
+        labelsAbove, labelsBelow = labels[above], labels[below]
+        lowest = np.minimum(labelsAbove, labelsBelow)
+        merged = labels.copy()
+        np.minimum.at(merged, labelsAbove, lowest)
+        np.minimum.at(merged, labelsBelow, lowest)
+        # point every run straight at its region's smallest id
+        while True:
+            jumped = merged[merged]
+            if np.array_equal(jumped, merged):
+                break
+            merged = jumped
+        if np.array_equal(merged, labels):
+            break
+        labels = merged
+    return runs, runStarts, labels
+
+
+def _keepLargestRegion(walls):
+    # wall up every floor cell outside its level's largest region
+    floor = walls == FLOOR
+    if not floor.any():
+        return walls
+    runs, runStarts, labels = _runRegions(floor)
+    runEnds = floor.copy()
+    runEnds[:, :, :-1] &= ~floor[:, :, 1:]
+    starts, ends = np.flatnonzero(runStarts), np.flatnonzero(runEnds)
+    runLevels = starts // runs[0].size
+    runLengths = ends - starts + 1
+    sizes = np.bincount(labels, weights=runLengths, minlength=len(labels))
+
+    # per level, the region with the most cells (smallest id on a tie)
+    roots = np.flatnonzero(labels == np.arange(len(labels)))
+    order = np.lexsort((roots, -sizes[roots], runLevels[roots]))
+    levels, first = np.unique(runLevels[roots][order], return_index=True)
+    largest = np.full(len(walls), -1, dtype=np.int32)
+    largest[levels] = roots[order][first]
+
+    kept = labels == largest[runLevels]
+    walls[floor & ~kept[runs]] = WALL
+    return walls
+
+
+def _squaredDistances(floor, points, wallValue):
+    # (N, height * width) squared distance of every cell to points[i] = [x, y],
+    # wallValue on walls
+    n, height, width = floor.shape
+    ys = np.arange(height, dtype=np.int32)[None, :, None] - points[:, 1, None, None].astype(np.int32)
+    xs = np.arange(width, dtype=np.int32)[None, None, :] - points[:, 0, None, None].astype(np.int32)
+    return np.where(floor, ys * ys + xs * xs, np.int32(wallValue)).reshape(n, -1)
+
+
+def cellularAutomata(amount, levelWidth, levelHeight, fillRatio=FILL_RATIO, generations=GENERATIONS, padding=2,
+                     seed=None):
+    rng = np.random.default_rng(seed)
+    walls = (rng.random((amount, levelHeight, levelWidth), dtype=np.float32) < fillRatio).astype(np.uint8)
+    levels = _keepLargestRegion(smooth(walls, generations, padding))
+    floor = levels == FLOOR
+
+    middle = np.tile(np.array([int(levelWidth / 2), int(levelHeight / 2)], dtype=np.int64), (amount, 1))
+    nearest = _squaredDistances(floor, middle, np.iinfo(np.int32).max).argmin(axis=1)
+    starts = np.stack([nearest % levelWidth, nearest // levelWidth], axis=1)
+    farthest = _squaredDistances(floor, starts, -1).argmax(axis=1)
+    ends = np.stack([farthest % levelWidth, farthest // levelWidth], axis=1)
+
+    # a level without any floor starts and ends in the middle
+    empty = ~floor.any(axis=(1, 2))
+    starts[empty] = middle[empty]
+    ends[empty] = middle[empty]
+    return levels, starts, ends
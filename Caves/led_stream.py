@@ -0,0 +1,158 @@
+### LED Stream: cave animations as a compact binary stream for LED matrices
+#
+# A frame is a few bitplanes, one bit per LED in row-major order (bit
+# y * width + x, least significant bit of each byte first): a 12x8 matrix is
+# 96 bits, 12 bytes per plane. The walk animations use plane 0 for the land
+# (WALL) and plane 1 for the walker.
+#
+# Stream layout, little endian:
+#
+#   header   'LEDS', version, width, height, planes (bytes), fps (uint16),
+#            frame count (uint32)
+#   frames   one record per frame, either
+#              0xFF + planes * planeBytes       a keyframe: the raw bitplanes
+#              n + n bit indices                the n bits that flip since
+#                                               the frame before
+#
+# Bit indices are plane * width * height + y * width + x, one byte each when
+# that fits (a 12x8 matrix with two planes: 192 bits), two bytes otherwise.
+# A walk step flips at most 3 bits, so most frames take 1 to 4 bytes instead
+# of 24. Every KEYFRAME_INTERVAL-th frame is a keyframe, so a player can
+# start mid-stream; so is any frame whose delta wouldn't be smaller.
+#
+#   data = encodeFrames(frames, fps=30)
+#   with openSink('cave.leds') as sink:   # or '-' for a pipe
+#       sink.write(data)
+#
+#   python led_stream.py cave.leds        # play it in the terminal
+#   python low_level_cave_system_r4.py --frames 3000 - | python led_stream.py -
+
+import argparse
+import struct
+import sys
+import time
+import numpy as np
+from cave_grid import WALL
+
+MAGIC = b'LEDS'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBBHI')
+KEYFRAME = 0xFF
+KEYFRAME_INTERVAL = 256
+FPS = 30
+
+
+def walkFrames(lands, positions):
+    # lands: (N, height, width) WALL / FLOOR after each step, positions:
+    # (N, 2) walker [x, y] -> bool frames (N, 2, height, width)
+    lands = np.asarray(lands)
+    positions = np.asarray(positions)
+    n, height, width = lands.shape
+    frames = np.zeros((n, 2, height, width), dtype=bool)
+    frames[:, 0] = lands == WALL
+    frames[np.arange(n), 1, positions[:, 1], positions[:, 0]] = True
+    return frames
+
+
+def encodeFrames(frames, fps=FPS):
+    # frames: bool (N, planes, height, width) -> the stream as bytes
+    frames = np.asarray(frames, dtype=bool)
+    n, planes, height, width = frames.shape
+    bits = frames.reshape(n, -1)
+    indexType = np.uint8 if bits.shape[1] <= 256 else np.dtype('<u2')
+    keyframes = np.packbits(frames.reshape(n, planes, -1), axis=2, bitorder='little').reshape(n, -1)
+    keyframeBytes = 1 + keyframes.shape[1]
+
+    # flipped bits of every frame against the one before, in one pass
+    flips = np.zeros_like(bits)
+    flips[1:] = bits[1:] ^ bits[:-1]
+    counts = flips.sum(axis=1)
+    indices = np.nonzero(flips)[1].astype(indexType)
+    ends = np.cumsum(counts)
+    indexBytes = np.dtype(indexType).itemsize
+
+    chunks = [HEADER.pack(MAGIC, VERSION, width, height, planes, fps, n)]
+    for frame in range(n):
+        count = int(counts[frame])
+        if (frame % KEYFRAME_INTERVAL == 0 or count >= KEYFRAME
+                or 1 + count * indexBytes >= keyframeBytes):
+            chunks.append(bytes([KEYFRAME]))
+            chunks.append(keyframes[frame].tobytes())
+        else:
+            chunks.append(bytes([count]))
+            chunks.append(indices[ends[frame] - count:ends[frame]].tobytes())
+    return b''.join(chunks)
+
+
+def decodeFrames(data):
+    # the player side, as a device would run it -> bool frames, fps
+    magic, version, width, height, planes, fps, n = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a version {} LED stream'.format(VERSION))
+    size = planes * width * height
+    planeBytes = (width * height + 7) // 8
+    indexType = np.uint8 if size <= 256 else np.dtype('<u2')
+    indexBytes = np.dtype(indexType).itemsize
+
+    frames = np.zeros((n, size), dtype=bool)
+    bits = np.zeros(size, dtype=bool)
+    position = HEADER.size
+    for frame in range(n):
+        count = data[position]
+        position += 1
+        if count == KEYFRAME:
+            raw = np.frombuffer(data, dtype=np.uint8, count=planes * planeBytes, offset=position)
+            bits = np.unpackbits(raw.reshape(planes, planeBytes), axis=1, count=width * height,
+                                 bitorder='little').astype(bool).ravel()
+            position += planes * planeBytes
+        else:
+            flipped = np.frombuffer(data, dtype=indexType, count=count, offset=position)
+            bits = bits.copy()
+            bits[flipped] ^= True
+            position += count * indexBytes
+        frames[frame] = bits
+    return frames.reshape(n, planes, height, width), fps
+
+
+def openSink(target):
+    # where a stream goes instead of a device: a file, a named pipe, or '-'
+    # for stdout
+    if target == '-':
+        return open(sys.stdout.fileno(), 'wb', closefd=False)
+    return open(target, 'wb')
+
+
+def frameText(frame, wall='1', floor='0', walker='*'):
+    # plane 0 as the LED digits, the walker (plane 1, if any) on top
+    chars = np.where(frame[0], wall, floor)
+    if len(frame) > 1:
+        chars[frame[1]] = walker
+    return '\n'.join(''.join(row) for row in chars)
+
+
+def play(data, realTime=True, out=sys.stdout):
+    # the terminal standing in for the matrix, a frame every 1 / fps seconds
+    frames, fps = decodeFrames(data)
+    start = time.monotonic()
+    for number, frame in enumerate(frames):
+        if realTime:
+            time.sleep(max(0, start + number / fps - time.monotonic()))
+        out.write('\033[H\033[J' + frameText(frame) + '\nframe {} / {}\n'.format(number + 1, len(frames)))
+        out.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play an LED stream in the terminal')
+    parser.add_argument('stream', help="stream file, or '-' to read a pipe")
+    parser.add_argument('--fast', action='store_true', help="don't wait for the stream's fps")
+    args = parser.parse_args()
+    if args.stream == '-':
+        data = sys.stdin.buffer.read()
+    else:
+        with open(args.stream, 'rb') as f:
+            data = f.read()
+    play(data, realTime=not args.fast)
+
+
+if __name__ == '__main__':
+    main()
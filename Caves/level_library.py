@@ -0,0 +1,260 @@
+### Level Library: generated levels kept on disk, queried by their scores
+#
+# A library is one append-only file, <path>.levels: a short header, then one
+# chunk per add():
+#
+#   'LVLS', record count (uint32), grid bytes (uint64)
+#   the chunk's index records: seed, generator, size, start and end, where
+#   its grid sits in the file, and its scores (pathLength and cave_scoring's
+#   METRICS), INDEX_DTYPE.itemsize bytes each
+#   the chunk's packed grids (1 bit per cell, as CaveGrid.packed), back to back
+#
+# Opening reads the chunk headers and records only, skipping over the grids;
+# grids are read through a memory map, so only the levels asked for are
+# paged in. Queries only look at the index, a few dozen bytes per level:
+#
+#   library = LevelLibrary('caves')
+#   rows = library.query(by='pathLength', top=50, openRatio=(0.3, None))
+#   level, start, end = library.level(rows[0])
+#
+# An add writes a single chunk at the end of the file under an exclusive
+# flock, so an interrupted add leaves at most one incomplete chunk. Opening
+# ignores it (it may be another process's add still being written); the next
+# add cuts it off before appending. Queries never take the lock.
+#
+#   python level_library.py caves --seeds 0-9999 --generator cellular
+#   python level_library.py caves --top 50 --where openRatio=0.3:
+
+import argparse
+import fcntl
+import os
+import struct
+import numpy as np
+from cave_grid import CaveGrid
+from cave_scoring import METRICS, levelMetrics
+from batched_bfs import batchedShortestPaths
+
+SCORES = ('pathLength',) + METRICS
+INDEX_DTYPE = np.dtype([
+    ('seed', '<u8'),
+    ('generator', 'U8'),
+    ('width', '<i4'),
+    ('height', '<i4'),
+    ('removeBlocks', '<i4'),
+    ('startX', '<i4'),
+    ('startY', '<i4'),
+    ('endX', '<i4'),
+    ('endY', '<i4'),
+    ('offset', '<i8'),
+    ('pathLength', '<i4'),
+] + [(name, '<f8') for name in METRICS])
+
+
+MAGIC = b'CAVELIB1'
+CHUNK = struct.Struct('<4sIQ')
+CHUNK_TAG = b'LVLS'
+
+
+def _scanChunks(f, end):
+    # the complete chunks from file position end on -> their index records,
+    # and where the last of them ends; an incomplete chunk after it is left
+    # alone, it's an add still being written or one that was interrupted
+    chunks = []
+    size = os.fstat(f.fileno()).st_size
+    f.seek(end)
+    while True:
+        header = f.read(CHUNK.size)
+        if len(header) < CHUNK.size:
+            break
+        tag, count, gridBytes = CHUNK.unpack(header)
+        recordBytes = count * INDEX_DTYPE.itemsize
+        if tag != CHUNK_TAG or end + CHUNK.size + recordBytes + gridBytes > size:
+            break
+        chunks.append(np.frombuffer(f.read(recordBytes), dtype=INDEX_DTYPE))
+        end = f.seek(gridBytes, os.SEEK_CUR)
+    return chunks, end
+
+
+class LevelLibrary:
+    def __init__(self, path):
+        self.path = path + '.levels'
+        if not os.path.exists(self.path):
+            with open(self.path, 'ab') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                if f.tell() == 0:
+                    f.write(MAGIC)
+        with open(self.path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a level library'.format(self.path))
+            chunks, self._end = _scanChunks(f, len(MAGIC))
+        # index records per chunk, joined into one array when next asked for
+        self._chunks = chunks
+        self._index = None
+        self._grids = None
+        self._keys = set()
+        self._addKeys(self.index)
+
+    def _addKeys(self, records):
+        self._keys.update(zip(
+            records['generator'].tolist(), records['width'].tolist(), records['height'].tolist(),
+            records['removeBlocks'].tolist(), records['seed'].tolist(),
+        ))
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = np.concatenate(self._chunks) if self._chunks else np.zeros(0, dtype=INDEX_DTYPE)
+            self._chunks = [self._index]
+        return self._index
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self._chunks)
+
+    def missingSeeds(self, seeds, generator, width, height, removeBlocks):
+        # the seeds whose level isn't in the library yet, in order
+        return [seed for seed in seeds if (generator, width, height, removeBlocks, seed) not in self._keys]
+
+    def add(self, levels, starts, ends, seeds, generator, removeBlocks):
+        # levels: uint8 (N, height, width), WALL / FLOOR; scored on the way in
+        levels = np.asarray(levels, dtype=np.uint8)
+        n, height, width = levels.shape
+        if n == 0:
+            return
+        starts, ends = np.asarray(starts).reshape(n, 2), np.asarray(ends).reshape(n, 2)
+        lengths = batchedShortestPaths(levels, starts, ends)
+        metrics = levelMetrics(levels, starts)
+
+        records = np.zeros(n, dtype=INDEX_DTYPE)
+        records['seed'] = seeds
+        records['generator'] = generator
+        records['width'], records['height'], records['removeBlocks'] = width, height, removeBlocks
+        records['startX'], records['startY'] = starts[:, 0], starts[:, 1]
+        records['endX'], records['endY'] = ends[:, 0], ends[:, 1]
+        records['pathLength'] = lengths
+        for name in METRICS:
+            records[name] = metrics[name]
+
+        # rows padded to whole bytes, like CaveGrid.packed
+        packed = np.packbits(levels, axis=2)
+        with open(self.path, 'r+b') as f:
+            # one writer at a time; under the lock an incomplete chunk can only
+            # be an interrupted add, so it's cut off before appending. Chunks
+            # other processes added since this library was opened are read in
+            fcntl.flock(f, fcntl.LOCK_EX)
+            chunks, self._end = _scanChunks(f, self._end)
+            f.truncate(self._end)
+            gridsAt = self._end + CHUNK.size + records.nbytes
+            records['offset'] = gridsAt + np.arange(n) * packed[0].nbytes
+            f.seek(self._end)
+            f.write(CHUNK.pack(CHUNK_TAG, n, packed.nbytes) + records.tobytes() + packed.tobytes())
+            f.flush()
+            self._end = f.tell()
+        for chunk in chunks:
+            self._addKeys(chunk)
+        self._chunks.extend(chunks)
+        self._chunks.append(records)
+        self._index = None
+        self._grids = None
+        self._addKeys(records)
+
+    def query(self, by='pathLength', top=None, descending=True, **conditions):
+        # -> row numbers, best first (earlier rows first on a tie)
+        # by: a score name, or weights {score name: weight} summed per level
+        # conditions: field=value, or field=(low, high) with low <= value <=
+        # high and None for an open end, e.g. openRatio=(0.3, None)
+        rows = np.ones(len(self.index), dtype=bool)
+        for name, condition in conditions.items():
+            if name not in INDEX_DTYPE.names:
+                raise ValueError("unknown field '{}', use one of {}".format(name, ', '.join(INDEX_DTYPE.names)))
+            values = self.index[name]
+            if isinstance(condition, tuple):
+                low, high = condition
+                if low is not None:
+                    rows &= values >= low
+                if high is not None:
+                    rows &= values <= high
+            else:
+                rows &= values == condition
+        rows = np.flatnonzero(rows)
+
+        if isinstance(by, dict):
+            scores = np.zeros(len(rows))
+            for name, weight in by.items():
+                if name not in SCORES:
+                    raise ValueError("unknown score '{}', use one of {}".format(name, ', '.join(SCORES)))
+                scores += weight * self.index[name][rows]
+        else:
+            if by not in SCORES:
+                raise ValueError("unknown score '{}', use one of {}".format(by, ', '.join(SCORES)))
+            scores = self.index[by][rows]
+        order = np.argsort(-scores if descending else scores, kind='stable')
+        return rows[order[:top]]
+
+    def level(self, row):
+        # -> [level, start, end] like drunkenWalkGenerator
+        record = self.index[row]
+        width, height = int(record['width']), int(record['height'])
+        if self._grids is None:
+            self._grids = np.memmap(self.path, dtype=np.uint8, mode='r')
+        offset = int(record['offset'])
+        packed = self._grids[offset:offset + height * ((width + 7) // 8)]
+        level = CaveGrid.fromPacked(packed, width, height)
+        return [level, [int(record['startX']), int(record['startY'])], [int(record['endX']), int(record['endY'])]]
+
+
+def parseSeeds(spec):
+    # "7" / "0-9999" / "1,5,9" -> list of ints
+    seeds = []
+    for item in spec.split(','):
+        if '-' in item:
+            low, high = item.split('-')
+            seeds.extend(range(int(low), int(high) + 1))
+        else:
+            seeds.append(int(item))
+    return seeds
+
+
+def parseCondition(spec):
+    # "openRatio=0.3:" / "width=55" -> name, value or (low, high)
+    name, value = spec.split('=')
+    if ':' not in value:
+        try:
+            return name, float(value)
+        except ValueError:
+            return name, value
+    low, high = value.split(':')
+    return name, (float(low) if low else None, float(high) if high else None)
+
+
+def main():
+    import mid_level_cave_system_BFS as caves
+
+    parser = argparse.ArgumentParser(description='Build up and query a cave level library')
+    parser.add_argument('path', help='library path, without the .levels extension')
+    parser.add_argument('--seeds', help='levels to add, e.g. 0-9999; ones already there are skipped')
+    parser.add_argument('--generator', default='walk', help=' or '.join(caves.levelGenerators))
+    parser.add_argument('--width', type=int, default=caves.levelWidth)
+    parser.add_argument('--height', type=int, default=caves.levelHeight)
+    parser.add_argument('--remove-blocks', type=int, default=caves.removeBlocks)
+    parser.add_argument('--top', type=int, help='print the best levels')
+    parser.add_argument('--by', default='pathLength', help=' / '.join(SCORES))
+    parser.add_argument('--where', action='append', default=[], help='field=value or field=low:high')
+    args = parser.parse_args()
+
+    caves.levelWidth, caves.levelHeight, caves.removeBlocks = args.width, args.height, args.remove_blocks
+    library = LevelLibrary(args.path)
+    if args.seeds:
+        added = caves.buildLibrary(library, parseSeeds(args.seeds), args.generator)
+        print('added {} levels, {} in the library'.format(added, len(library)))
+
+    if args.top:
+        conditions = dict(parseCondition(spec) for spec in args.where)
+        for row in library.query(args.by, args.top, **conditions):
+            record = library.index[row]
+            scores = '  '.join('{} {:.3g}'.format(name, record[name]) for name in SCORES)
+            print('{:>8}  seed {:<10} {:<8} {}x{}  {}'.format(
+                row, record['seed'], record['generator'], record['width'], record['height'], scores))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,42 +1,79 @@
+import argparse
 import random
+import time
+from cave_grid import CaveGrid, WALL, FLOOR
+from led_stream import walkFrames, encodeFrames, openSink, FPS
 
 width = 12  # Adjust according to your LED matrix width
 height = 8  # Adjust according to your LED matrix height
 
-drunk = {
-    'wallCountdown': 1500,
-    'padding': 2,
-    'x': int(width / 2),
-    'y': int(height / 2)
-}
+def carveLevel(steps=None):
+    # steps: a list that gets (level cells, x, y) after every step, for the
+    # LED animation
+    drunk = {
+        'wallCountdown': 1500,
+        'padding': 2,
+        'x': int(width / 2),
+        'y': int(height / 2)
+    }
 
-def getLevelRow():
-    return [1] * width  # Use 1 to represent the land in the LED matrix
+    # the walk carves wallCountdown + 1 cells and never leaves the padding,
+    # so it can't ask for more than the cells inside it or it never ends
+    carvable = (width - 2 * drunk['padding']) * (height - 2 * drunk['padding'])
+    drunk['wallCountdown'] = min(drunk['wallCountdown'], carvable - 1)
 
-level = [getLevelRow() for _ in range(height)]
+    # WALL (1) is the land in the LED matrix, FLOOR (0) empty space
+    level = CaveGrid.walls(width, height)
 
-while drunk['wallCountdown'] >= 0:
-    x = drunk['x']
-    y = drunk['y']
+    while drunk['wallCountdown'] >= 0:
+        x = drunk['x']
+        y = drunk['y']
 
-    if level[y][x] == 1:
-        level[y][x] = 0  # Use 0 to represent empty space in the LED matrix
-        drunk['wallCountdown'] -= 1
+        if level[y, x] == WALL:
+            level[y, x] = FLOOR
+            drunk['wallCountdown'] -= 1
 
-    roll = random.randint(1, 4)
+        if steps is not None:
+            steps.append((level.cells.copy(), x, y))
 
-    if roll == 1 and x > drunk['padding']:
-        drunk['x'] -= 1
+        roll = random.randint(1, 4)
 
-    if roll == 2 and x < width - 1 - drunk['padding']:
-        drunk['x'] += 1
+        if roll == 1 and x > drunk['padding']:
+            drunk['x'] -= 1
 
-    if roll == 3 and y > drunk['padding']:
-        drunk['y'] -= 1
+        if roll == 2 and x < width - 1 - drunk['padding']:
+            drunk['x'] += 1
 
-    if roll == 4 and y < height - 1 - drunk['padding']:
-        drunk['y'] += 1
+        if roll == 3 and y > drunk['padding']:
+            drunk['y'] -= 1
 
-# Print the LED matrix
-for row in level:
-    print(''.join(map(str, row)))
+        if roll == 4 and y < height - 1 - drunk['padding']:
+            drunk['y'] += 1
+
+    return level
+
+def recordFrames(frameCount):
+    # one carving after the other until there are frameCount frames
+    steps = []
+    while len(steps) < frameCount:
+        carveLevel(steps)
+    steps = steps[:frameCount]
+    return walkFrames([cells for cells, _, _ in steps], [[x, y] for _, x, y in steps])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Carve a cave for the LED matrix')
+    parser.add_argument('stream', nargs='?', help="record the carving as an LED stream to this file, or '-' for a pipe")
+    parser.add_argument('--frames', type=int, default=3000)
+    parser.add_argument('--fps', type=int, default=FPS)
+    args = parser.parse_args()
+
+    if args.stream is None:
+        # Print the LED matrix
+        print(carveLevel().toText(wall='1', floor='0'))
+    else:
+        start = time.perf_counter()
+        data = encodeFrames(recordFrames(args.frames), args.fps)
+        with openSink(args.stream) as sink:
+            sink.write(data)
+        if args.stream != '-':
+            print('{} frames, {} bytes in {:.3f} s'.format(args.frames, len(data), time.perf_counter() - start))
@@ -9,6 +9,19 @@
 ### 5 - Sort levels on number of steps to retrieve the best level
 
 import random
+import numpy as np
+import heapq
+from array import array
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from batched_walk import batchedDrunkenWalk
+from cave_grid import CaveGrid, WALL, FLOOR
+from cave_scoring import METRICS, scoreLevels
+from batched_bfs import batchedShortestPaths
+from cellular_caves import cellularAutomata
+from level_library import LevelLibrary
 
 levelWidth = 55
 levelHeight = 35
@@ -17,12 +30,10 @@ amountOfLevels = 100
 removeBlocks = 500
 
 ### Easy Procedural Generation: Drunken Walk Algorithm
+### levels are CaveGrids throughout; text only when printed (toText / toRows)
 
-def getLevelRow():
-    return ['#'] * levelWidth
-
-def getWallLevel():
-    return [getLevelRow() for _ in range(levelHeight)]
+# '#' cells of lists-of-characters levels as 1 bytes, everything else as 0
+wallBytes = bytes(WALL if code == ord('#') else FLOOR for code in range(256))
 
 def drunkenWalkGenerator():
     drunk = {
@@ -34,7 +45,8 @@ def drunkenWalkGenerator():
     
     startCoordinate = [drunk['x'], drunk['y']]
     
-    level = getWallLevel()
+    # one byte per cell, y * levelWidth + x
+    cells = bytearray([WALL]) * (levelWidth * levelHeight)
     
     x = -1
     y = -1
@@ -43,8 +55,8 @@ def drunkenWalkGenerator():
         x = drunk['x']
         y = drunk['y']
         
-        if level[y][x] == '#':
-            level[y][x] = '.'
+        if cells[y * levelWidth + x] == WALL:
+            cells[y * levelWidth + x] = FLOOR
             drunk['removeBlocks'] -= 1
         
         roll = random.randint(1, 4)
@@ -60,56 +72,126 @@ def drunkenWalkGenerator():
     
     endCoordinate = [x, y]
     
+    level = CaveGrid.fromBuffer(cells, levelWidth, levelHeight)
+    
     return [level, startCoordinate, endCoordinate]
 
-### Easy Pathfinding: Breadth-First Algorithm
+### Cellular Automata: random fill + smoothing (cellular_caves.py)
+### roomier caves than the walk, and cheap at thousands of cells per side
 
-def getNextMoves(x, y):
-    return {
-        'left':  [x-1, y], 
-        'right': [x+1, y],
-        'up':  [x, y-1],
-        'down':  [x, y+1]
-    }.values()
-
-def getShortestPath(level, startCoordinate, endCoordinate):
-    searchPaths = [[startCoordinate]]
-    visitedCoordinates = [startCoordinate]
+def cellularAutomataGenerator():
+    # same [level, start, end] as drunkenWalkGenerator; the seed comes from
+    # random, so random.seed() repeats the level as it does for the walk
+    levels, starts, ends = cellularAutomata(1, levelWidth, levelHeight, seed=random.getrandbits(64))
+    level = CaveGrid(levels[0])
     
-    while searchPaths != []:
-        currentPath = searchPaths.pop(0)
-        currentCoordinate = currentPath[-1]
-        
-        currentX, currentY = currentCoordinate
-        
-        if currentCoordinate == endCoordinate:
-            return currentPath
-        
-        for nextCoordinate in getNextMoves(currentX, currentY):
-            nextX, nextY = nextCoordinate
-            
-            if nextX < 0 or nextX >= levelWidth:
+    return [level, starts[0].tolist(), ends[0].tolist()]
+
+levelGenerators = {
+    'walk': drunkenWalkGenerator,
+    'cellular': cellularAutomataGenerator,
+}
+
+def checkGenerator(generator):
+    if generator not in levelGenerators:
+        raise ValueError("unknown generator '{}', use one of {}".format(generator, ', '.join(levelGenerators)))
+
+def generateLevelStack(amount, seed=None, generator='walk'):
+    # all levels at once: uint8 (amount, levelHeight, levelWidth), starts, ends
+    checkGenerator(generator)
+    if generator == 'cellular':
+        return cellularAutomata(amount, levelWidth, levelHeight, seed=seed)
+    return batchedDrunkenWalk(amount, levelWidth, levelHeight, removeBlocks, seed=seed)
+
+### Easy Pathfinding: Breadth-First Algorithm
+
+def getShortestPath(level, startCoordinate, endCoordinate, returnDistances=False):
+    # level: a CaveGrid (lists of characters work too)
+    # cells are numbered y * width + x; parents[cell] is the cell it was
+    # reached from (-1 = not reached yet), which doubles as the visited check,
+    # and the path is walked back from the end once it is reached
+    if isinstance(level, CaveGrid):
+        width, height = level.width, level.height
+        walls = level.cells.tobytes()
+    else:
+        width, height = len(level[0]), len(level)
+        walls = ''.join(map(''.join, level)).encode().translate(wallBytes)
+    startX, startY = startCoordinate
+    endX, endY = endCoordinate
+    start = startY * width + startX
+    end = endY * width + endX
+
+    parents = array('i', [-1]) * (width * height)
+    parents[start] = start
+    distances = array('i', [-1]) * (width * height) if returnDistances else None
+    if returnDistances:
+        distances[start] = 0
+
+    searchCells = deque([start])
+
+    while searchCells:
+        currentCell = searchCells.popleft()
+
+        # the distance field needs the whole level, the path only this far
+        if currentCell == end and not returnDistances:
+            break
+
+        currentY, currentX = divmod(currentCell, width)
+
+        # left, right, up, down
+        for nextX, nextY, nextCell in (
+            (currentX - 1, currentY, currentCell - 1),
+            (currentX + 1, currentY, currentCell + 1),
+            (currentX, currentY - 1, currentCell - width),
+            (currentX, currentY + 1, currentCell + width),
+        ):
+            if nextX < 0 or nextX >= width:
                 continue
-            
-            if nextY < 0 or nextY >= levelHeight:
+
+            if nextY < 0 or nextY >= height:
                 continue
-            
-            if nextCoordinate in visitedCoordinates:
+
+            if parents[nextCell] != -1:
                 continue
-            
-            if level[nextY][nextX] == '#':
+
+            if walls[nextCell] == WALL:
                 continue
-            
-            searchPaths.append(currentPath + [nextCoordinate])
-            visitedCoordinates += [nextCoordinate]
-    
-    return []
+
+            parents[nextCell] = currentCell
+            if returnDistances:
+                distances[nextCell] = distances[currentCell] + 1
+            searchCells.append(nextCell)
+
+    path = []
+    if parents[end] != -1:
+        cell = end
+        while cell != start:
+            path.append([cell % width, cell // width])
+            cell = parents[cell]
+        path.append([startX, startY])
+        path.reverse()
+
+    if returnDistances:
+        # -1 where the start can't be reached from; an int32 array for grids
+        if isinstance(level, CaveGrid):
+            return path, np.frombuffer(distances, dtype=np.int32).reshape(height, width)
+        return path, [distances[y * width:(y + 1) * width].tolist() for y in range(height)]
+    return path
 
 ### Improved Procedural Generation:
 ### Drunken Walk + Breadth First Algorithm
 
-def generateLevels(amount):
-    return [drunkenWalkGenerator() for _ in range(amount)]
+def generateLevels(amount, batched=False, seed=None, generator='walk'):
+    # generator: 'walk' or 'cellular', see levelGenerators
+    # batched: all levels at once in NumPy (generateLevelStack), reproducible from seed
+    if batched:
+        levels, starts, ends = generateLevelStack(amount, seed, generator)
+        return [
+            [CaveGrid(level), start.tolist(), end.tolist()]
+            for level, start, end in zip(levels, starts, ends)
+        ]
+    checkGenerator(generator)
+    return [levelGenerators[generator]() for _ in range(amount)]
 
 def evaluateLevels(levels):
     evaluationScores = []
@@ -127,19 +209,202 @@ def evaluateLevels(levels):
     
     return evaluationScores
 
-def generateBestLevel(amountOfLevels):
-    levels = generateLevels(amountOfLevels)
+def generateBestLevel(amountOfLevels, batched=False, seed=None, parallel=False, timeBudget=None, targetScore=None,
+                      weights=None, generator='walk', library=None):
+    # library: a LevelLibrary (or its path) to look the best level up in,
+    # see bestLibraryLevel
+    if library is not None:
+        return bestLibraryLevel(library, amountOfLevels, seed, weights, generator)
+
+    # parallel: searchBestLevels on a process pool, which can also stop at
+    # a time budget or a target score; weights rank there too
+    if parallel:
+        if batched:
+            raise ValueError('generateBestLevel: batched and parallel are different searches, pick one')
+        results = searchBestLevels(1, amountOfLevels, timeBudget, targetScore, seed=seed, generator=generator,
+                                   weights=weights)
+        if not results:
+            raise ValueError('generateBestLevel needs amountOfLevels > 0')
+        return results[0][1]
+
+    # weights: rank by cave_scoring's metrics instead of the path length,
+    # e.g. {'deadEnds': -1, 'corridorWidth': 10}
+    if weights is not None:
+        if batched:
+            levels, starts, ends = generateLevelStack(amountOfLevels, seed, generator)
+        else:
+            checkGenerator(generator)
+            walks = [levelGenerators[generator]() for _ in range(amountOfLevels)]
+            levels = np.stack([generatedLevel.cells for generatedLevel, _, _ in walks])
+            starts = np.array([startCoordinate for _, startCoordinate, _ in walks])
+        scores, _ = scoreLevels(levels, weights, starts)
+        return CaveGrid(levels[int(np.argmax(scores))])
+
+    # batched: walks and BFS both over the whole stack (batched_bfs.py), the
+    # first of the longest paths wins as with the sort below
+    if batched:
+        levels, starts, ends = generateLevelStack(amountOfLevels, seed, generator)
+        lengths = batchedShortestPaths(levels, starts, ends)
+        return CaveGrid(levels[int(np.argmax(lengths))])
+
+    levels = generateLevels(amountOfLevels, batched, seed, generator)
     
     evaluationScores = evaluateLevels(levels)
     
-    evaluationScores.sort()
-    evaluationScores.reverse()
+    # by score only: on a tie the first level wins, levels are never compared
+    evaluationScores.sort(key=lambda evaluation: evaluation[0], reverse=True)
     
     score, bestLevel = evaluationScores.pop(0)
     
     return bestLevel
 
-bestLevel = generateBestLevel(amountOfLevels)
+### Parallel Search:
+### score levels on a process pool, keep only the best k
+
+# seeds per task sent to a worker
+seedsPerTask = 32
+
+def scoreSeeds(seeds, levelSize, generator='walk', weights=None):
+    # worker side: the level of each seed is rebuilt from the seed alone, so
+    # only [score, seed] pairs travel back; the score is the path length, or
+    # with weights the weighted cave_scoring metrics
+    global levelWidth, levelHeight, removeBlocks
+    levelWidth, levelHeight, removeBlocks = levelSize
+
+    walks = [levelFromSeed(levelSeed, generator) for levelSeed in seeds]
+    if weights is not None:
+        levels = np.stack([generatedLevel.cells for generatedLevel, _, _ in walks])
+        starts = np.array([startCoordinate for _, startCoordinate, _ in walks])
+        scores, _ = scoreLevels(levels, weights, starts)
+        return [[float(score), levelSeed] for score, levelSeed in zip(scores, seeds)]
+
+    scores = []
+    for (generatedLevel, startCoordinate, endCoordinate), levelSeed in zip(walks, seeds):
+        scores.append([len(getShortestPath(generatedLevel, startCoordinate, endCoordinate)), levelSeed])
+    return scores
+
+def levelFromSeed(levelSeed, generator='walk'):
+    # the generators draw from the global random, so its state is put back
+    # afterwards: rebuilding a level doesn't reseed the caller's random
+    state = random.getstate()
+    try:
+        random.seed(levelSeed)
+        return levelGenerators[generator]()
+    finally:
+        random.setstate(state)
+
+def searchBestLevels(k=1, amount=None, timeBudget=None, targetScore=None, workers=None, seed=None, generator='walk',
+                     weights=None):
+    # Scores up to `amount` levels (seed, seed + 1, ...) and returns the best
+    # k as [score, level, start, end, levelSeed], best first; scored by path
+    # length, or by weights as in generateBestLevel. Stops early after
+    # `timeBudget` seconds or once a level scores `targetScore` or more, but
+    # not before the first task is back, so there is always a result. Tasks
+    # still running then are abandoned, not waited for.
+    # Only the k best [score, seed] pairs are kept while searching.
+    if amount is None and timeBudget is None:
+        raise ValueError('searchBestLevels needs an amount, a timeBudget or both')
+    if k < 1:
+        raise ValueError('searchBestLevels needs k >= 1')
+    checkGenerator(generator)
+    # unknown metric names fail here rather than in every worker
+    for name in weights or ():
+        if name not in METRICS:
+            raise ValueError("unknown metric '{}', use one of {}".format(name, ', '.join(METRICS)))
+    if seed is None:
+        seed = random.randrange(2**32)
+    workers = workers or os.cpu_count() or 1
+    levelSize = (levelWidth, levelHeight, removeBlocks)
+    deadline = None if timeBudget is None else time.monotonic() + timeBudget
+
+    # min-heap of (score, -seed): the root is the worst of the best k, and
+    # on equal scores the earlier seed stays
+    best = []
+    nextSeed = seed
+    lastSeed = None if amount is None else seed + amount
+    running = set()
+    done = False
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        while not done:
+            # keep two tasks per worker in flight
+            while len(running) < 2 * workers and (lastSeed is None or nextSeed < lastSeed):
+                stop = nextSeed + seedsPerTask if lastSeed is None else min(nextSeed + seedsPerTask, lastSeed)
+                running.add(pool.submit(scoreSeeds, range(nextSeed, stop), levelSize, generator, weights))
+                nextSeed = stop
+            if not running:
+                break
+
+            timeout = None if deadline is None or not best else max(0, deadline - time.monotonic())
+            finished, running = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in finished:
+                for score, levelSeed in future.result():
+                    if len(best) < k:
+                        heapq.heappush(best, (score, -levelSeed))
+                    elif (score, -levelSeed) > best[0]:
+                        heapq.heapreplace(best, (score, -levelSeed))
+                    if targetScore is not None and score >= targetScore:
+                        done = True
+
+            if deadline is not None and time.monotonic() >= deadline and best:
+                done = True
+    finally:
+        # queued tasks are cancelled and the ones running finish in the
+        # background, so the budget isn't overrun by their batches
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    results = []
+    for score, negatedSeed in sorted(best, reverse=True):
+        generatedLevel, startCoordinate, endCoordinate = levelFromSeed(-negatedSeed, generator)
+        results.append([score, generatedLevel, startCoordinate, endCoordinate, -negatedSeed])
+    return results
+
+### Level Library:
+### every scored level kept on disk (level_library.py), so asking again is a lookup
+
+# levels generated and scored per library add
+libraryBatch = 1024
+
+def buildLibrary(library, seeds, generator='walk'):
+    # adds the level of each seed the library doesn't have yet, at the
+    # current level size; the seeds are the ones levelFromSeed and
+    # searchBestLevels use -> number of levels added
+    checkGenerator(generator)
+    seeds = library.missingSeeds(seeds, generator, levelWidth, levelHeight, removeBlocks)
+    for begin in range(0, len(seeds), libraryBatch):
+        batch = seeds[begin:begin + libraryBatch]
+        walks = [levelFromSeed(levelSeed, generator) for levelSeed in batch]
+        library.add(
+            np.stack([generatedLevel.cells for generatedLevel, _, _ in walks]),
+            [startCoordinate for _, startCoordinate, _ in walks],
+            [endCoordinate for _, _, endCoordinate in walks],
+            batch, generator, removeBlocks,
+        )
+    return len(seeds)
+
+def bestLibraryLevel(library, amountOfLevels, seed=None, weights=None, generator='walk'):
+    # With a seed: the best of the levels seed .. seed + amountOfLevels - 1,
+    # generated only the first time. Without: the best stored level of the
+    # current size, after topping the library up with random seeds to
+    # amountOfLevels levels. Ranked by path length, or by weights over
+    # pathLength and cave_scoring's metrics.
+    if not isinstance(library, LevelLibrary):
+        library = LevelLibrary(library)
+    size = dict(generator=generator, width=levelWidth, height=levelHeight, removeBlocks=removeBlocks)
+    if seed is not None:
+        seeds = range(seed, seed + amountOfLevels)
+        buildLibrary(library, seeds, generator)
+        size['seed'] = (seed, seed + amountOfLevels - 1)
+    else:
+        stored = len(library.query(**size))
+        if stored < amountOfLevels:
+            buildLibrary(library, [random.randrange(2**63) for _ in range(amountOfLevels - stored)], generator)
+    best = library.query(by='pathLength' if weights is None else weights, top=1, **size)[0]
+    generatedLevel, startCoordinate, endCoordinate = library.level(best)
+    return generatedLevel
+
+if __name__ == '__main__':
+    bestLevel = generateBestLevel(amountOfLevels)
 
-for row in bestLevel:
-    print( ''.join(row) )
+    print(bestLevel.toText())
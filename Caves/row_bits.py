@@ -0,0 +1,78 @@
+### Row Bits: stacks of levels as 64 bit words per row
+#
+# A bool stack (n, height, width) packs into uint64 (n, height, words) with
+# bit x % 64 of word x // 64 standing for cell x. Moving every cell of every
+# level one step is then a shift of a few hundred thousand words, which is
+# what the batched flood fills and BFS are built on.
+
+import numpy as np
+
+
+def packRows(mask):
+    # bool (n, height, width) -> uint64 (n, height, words)
+    n, height, width = mask.shape
+    words = (width + 63) // 64
+    padded = np.zeros((n, height, words * 64), dtype=bool)
+    padded[:, :, :width] = mask
+    return np.packbits(padded, axis=2, bitorder='little').view('<u8')
+
+
+def unpackRows(bits, width):
+    # uint64 (n, height, words) -> bool (n, height, width)
+    cells = np.unpackbits(bits.view(np.uint8), axis=2, count=width, bitorder='little')
+    return cells.view(bool)
+
+
+def countBits(bits):
+    # set cells per level
+    return np.unpackbits(bits.view(np.uint8).reshape(len(bits), -1), axis=1).sum(axis=1)
+
+
+def testBits(bits, xs, ys):
+    # bits[i] at cell (xs[i], ys[i]), per level
+    words = bits[np.arange(len(bits)), ys, xs // 64]
+    return (words >> (xs % 64).astype(np.uint64)) & np.uint64(1) == 1
+
+
+def shiftRight(bits, k=1):
+    # cell x -> x + k along the row, across word boundaries
+    words, k = divmod(k, 64)
+    if words:
+        out = np.zeros_like(bits)
+        out[:, :, words:] = bits[:, :, :-words]
+        bits = out
+    if k == 0:
+        return bits
+    out = bits << np.uint64(k)
+    out[:, :, 1:] |= bits[:, :, :-1] >> np.uint64(64 - k)
+    return out
+
+
+def shiftLeft(bits, k=1):
+    words, k = divmod(k, 64)
+    if words:
+        out = np.zeros_like(bits)
+        out[:, :, :-words] = bits[:, :, words:]
+        bits = out
+    if k == 0:
+        return bits
+    out = bits >> np.uint64(k)
+    out[:, :, :-1] |= bits[:, :, 1:] << np.uint64(64 - k)
+    return out
+
+
+def shiftDown(bits, k=1):
+    out = np.zeros_like(bits)
+    out[:, k:] = bits[:, :-k]
+    return out
+
+
+def shiftUp(bits, k=1):
+    out = np.zeros_like(bits)
+    out[:, :-k] = bits[:, k:]
+    return out
+
+
+def neighbours(bits):
+    # every cell one step left, right, up or down of a set cell
+    return shiftRight(bits) | shiftLeft(bits) | shiftDown(bits) | shiftUp(bits)
@@ -2,52 +2,57 @@ from tkinter import *
 from tkinter.filedialog import asksaveasfilename,asksaveasfile
 from PIL.Image import fromarray
 from PIL import ImageTk, Image
-import noise
 import numpy as np
-import time
+import queue
+import threading
+from perlin import fractal_noise, tile_noise, OctaveCache
+from palette import palette_for
+from pipeline import TerrainPipeline
+from profiling import profiler
 
 
-
-# for measuring time
-def timing(f):
-    def wrap(*args, **kwargs):
-        time1 = time.time()
-        ret = f(*args, **kwargs)
-        time2 = time.time()
-        print('{:s} function took {:.3f} ms'.format(f.__name__, (time2-time1)*1000.0))
-        return ret
-    return wrap
-
 WHT = "#eeeeee"
 FONT = ("Tahoma","15")
 FONT2 = ("Tahoma", "8")
 
+PREVIEW_FACTOR = 4 # the preview is 1/4 of the size in each direction
+POLL_MS = 30 # how often the Tk loop checks for finished images
+
 
 class Generator:
-    def __init__(self):
-        pass
+    # workers: processes used by get_random_noise, 1 = serial, None = every core
+    # keep_octaves: keep the last map's octave layers so octave/persistence
+    # edits only compute the difference (serial mode)
+    def __init__(self, workers=1, keep_octaves=False):
+        self.workers = workers
+        self.octave_cache = OctaveCache() if keep_octaves else None
 
     def get_random_noise(self, scale, shape, octaves, persistence, lacunarity, seed=False):
         scale = shape[1] * (scale / 100)
         persistence /= 100
         lacunarity /= 10
-        world = np.zeros(shape)
         if seed == False or seed <= 0: seed = np.random.randint(1,100)
-        for i in range(shape[0]):
-            for j in range(shape[1]):
-                world[i][j] = noise.pnoise2(i / scale, j / scale,
-                                            octaves=octaves,
-                                            persistence=persistence,
-                                            lacunarity=lacunarity,
-                                            base=seed)
+        if self.octave_cache is not None and self.workers == 1:
+            world = self.octave_cache.fractal_noise(shape, scale, octaves, persistence, lacunarity, seed)
+        else:
+            world = fractal_noise(shape, scale, octaves, persistence, lacunarity, seed, workers=self.workers)
         return ((world + 1) * 128).astype(np.uint8)
 
-    def assign_colors(self, layers, noise_array, sea_level):
-        altitudes = (layers[:, 2] + sea_level).astype(int)
-        colors = np.array([np.array([*color], dtype=np.uint8) for color in layers[:, 1]])
-        color_indices = np.digitize(noise_array, altitudes)
-        color_array = np.array([colors[ind] for ind in color_indices])
-        return color_array
+    # tile (tx, ty) of an unbounded world at the given zoom (2**zoom pixels per
+    # world pixel), in the same slider units as get_random_noise; scale is a
+    # percentage of width, so zoom-0 tiles line up with a width-wide map
+    def get_noise_tile(self, tx, ty, zoom, tile_size, scale, width, octaves, persistence, lacunarity, seed):
+        if seed <= 0:
+            raise ValueError("tiles of one world need a fixed seed > 0")
+        scale = width * (scale / 100)
+        persistence /= 100
+        lacunarity /= 10
+        world = tile_noise(tx, ty, zoom, tile_size, scale, octaves, persistence, lacunarity, seed)
+        return ((world + 1) * 128).astype(np.uint8)
+
+    # out: optional uint8 (height, width, 3) buffer to colour into
+    def assign_colors(self, layers, noise_array, sea_level, out=None):
+        return palette_for(layers, sea_level).apply(noise_array, out=out)
 
     def noise_array_to_image(self,noise_world):
         return fromarray(noise_world, mode="L")
@@ -61,7 +66,17 @@ class App:
         self.stg = stg
         self.layers = layers
 
-        self.gen = Generator()
+        self.gen = Generator(keep_octaves=True)
+        self.pipeline = TerrainPipeline(self.gen)
+        # previews get their own pipeline so they don't evict the full-size octave layers
+        self.preview_pipeline = TerrainPipeline(Generator())
+
+        # generation runs on a worker thread; only the newest request is kept
+        self.request_id = 0
+        self.pending = None
+        self.wakeup = threading.Condition()
+        self.results = queue.Queue()
+        threading.Thread(target=self.worker, daemon=True).start()
 
         height,width = self.master.winfo_screenheight(),self.master.winfo_screenwidth()
         # default, min, max
@@ -98,6 +113,7 @@ class App:
 
         self.draw()
         self.generate()
+        self.poll_results()
 
     def get_inputs(self):
         for key in self.frm:
@@ -113,24 +129,72 @@ class App:
             self.wid[key].delete(0, "end")
             self.wid[key].insert(0, self.stg[key][0])
 
-    @timing
     def generate(self):
         self.get_inputs()
 
-        noise_array = self.gen.get_random_noise(
-            self.stg["scale"][0], (self.stg["height"][0], self.stg["width"][0]), self.stg["octaves"][0], self.stg["persistence"][0], self.stg["lacunarity"][0],
-            seed=self.stg["seed"][0]
-        )
-        color_array = self.gen.assign_colors(layers, noise_array, self.stg["sea_level"][0])
-
-        self.image = self.gen.color_array_to_image(color_array)
-        #self.image = self.gen.noise_array_to_image(noise_array)
+        shape = (self.stg["height"][0], self.stg["width"][0])
+        noise_stg = (self.stg["scale"][0], self.stg["octaves"][0], self.stg["persistence"][0], self.stg["lacunarity"][0])
+        seed = self.pipeline.choose_seed(shape, *noise_stg, self.stg["seed"][0], self.layers, self.stg["sea_level"][0])
 
-        self.tk_image = ImageTk.PhotoImage(self.image)
-        self.bg_label.config(image=self.tk_image)
+        # a newer request replaces one the worker hasn't started, and makes
+        # the one it is working on stale
+        with self.wakeup:
+            self.request_id += 1
+            self.pending = (self.request_id, shape, noise_stg, seed, self.stg["sea_level"][0])
+            self.wakeup.notify()
 
         self.master.geometry(str(self.stg["width"][0]) + "x" + str(self.stg["height"][0]))
 
+    def worker(self):
+        while True:
+            with self.wakeup:
+                while self.pending is None:
+                    self.wakeup.wait()
+                job = self.pending
+                self.pending = None
+            request_id, shape, noise_stg, seed, sea_level = job
+
+            # coarse preview first, unless the full heightmap is already cached
+            if not self.pipeline.has_heightmap(shape, *noise_stg, seed):
+                small = (max(1, shape[0] // PREVIEW_FACTOR), max(1, shape[1] // PREVIEW_FACTOR))
+                with profiler.stage("preview"):
+                    noise_array = self.preview_pipeline.heightmap(small, *noise_stg, seed)
+                    if request_id != self.request_id:
+                        continue
+                    color_array = self.preview_pipeline.colors(self.layers, noise_array, sea_level)
+                    preview = self.gen.color_array_to_image(color_array).resize((shape[1], shape[0]), Image.NEAREST)
+                self.results.put((request_id, False, preview))
+
+            if request_id != self.request_id:
+                continue
+            self.results.put((request_id, True, self.render(shape, noise_stg, seed, sea_level)))
+
+    @profiler.profile("render", report=True)
+    def render(self, shape, noise_stg, seed, sea_level):
+        # the heightmap comes from the pipeline's cache when only colours changed
+        with profiler.stage("noise"):
+            noise_array = self.pipeline.heightmap(shape, *noise_stg, seed)
+        with profiler.stage("colors"):
+            color_array = self.pipeline.colors(self.layers, noise_array, sea_level)
+        with profiler.stage("image"):
+            return self.gen.color_array_to_image(color_array)
+        #return self.gen.noise_array_to_image(noise_array)
+
+    def poll_results(self):
+        # Tk isn't thread-safe: images are handed over here, on the main loop
+        try:
+            while True:
+                request_id, final, image = self.results.get_nowait()
+                if request_id != self.request_id:
+                    continue
+                if final:
+                    self.image = image
+                with profiler.stage("photoimage"):
+                    self.tk_image = ImageTk.PhotoImage(image)
+                self.bg_label.config(image=self.tk_image)
+        except queue.Empty:
+            pass
+        self.master.after(POLL_MS, self.poll_results)
 
     def draw(self):
         self.bg_label.place(x=0, y=0, relwidth=1, relheight=1)
@@ -159,7 +223,8 @@ class App:
         dir = asksaveasfilename(
             title="Save your terrain"
         )
-        if dir:
+        # self.image is the last full-size map, never a preview
+        if dir and self.image is not None:
             self.image.save(dir+".png")
 
 # (default, min, max)
@@ -202,6 +267,7 @@ layers = np.array([
     ["snow", (245, 240, 240), 255]
 ])
 
-root = Tk()
-app = App(root, stg, layers)
-root.mainloop()
\ No newline at end of file
+if __name__ == "__main__":
+    root = Tk()
+    app = App(root, stg, layers)
+    root.mainloop()
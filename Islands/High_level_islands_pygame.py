@@ -1,15 +1,18 @@
+import math
 import pygame
-import noise
 import numpy as np
+from perlin import fractal_noise, tile_noise
+from palette import palette_for
+from tile_loader import TileCache, TileLoader
+from mip_pyramid import MipPyramid
 import time
 
 # Terrain settings
-resolution = 500
 scale = 45
 octaves = 6
 persistence = 0.55
 lacunarity = 2.0
-seed = 0
+seed = 1
 sea_level = 120
 
 # Pygame settings
@@ -18,6 +21,14 @@ zoom_factor = 1.2
 scroll_speed = 50
 cell_size = 5
 
+# Tile settings
+tile_size = 256
+min_tile_zoom, max_tile_zoom = -8, 8
+prefetch_ring = 1  # tiles generated ahead of time around the view
+max_wanted_tiles = 256  # hard cap on tiles requested per frame
+cache_bytes = 256 * 2**20  # surface cache cap
+placeholder_color = (205, 205, 205)
+
 # Define layers
 layers = np.array([
     ["blue1", (22, 156, 233), -10],
@@ -34,87 +45,152 @@ layers = np.array([
 ])
 
 class TerrainGenerator:
-    def __init__(self, seed=None):
+    def __init__(self, seed=None, workers=1):
         self.seed = seed if seed is not None else 0
+        self.workers = workers
 
     def get_random_noise(self, scale, shape, octaves, persistence, lacunarity):
-        world = np.zeros(shape)
-        for i in range(shape[0]):
-            for j in range(shape[1]):
-                world[i][j] = noise.pnoise2(i / scale, j / scale,
-                                            octaves=octaves,
-                                            persistence=persistence,
-                                            lacunarity=lacunarity,
-                                            base=self.seed)
+        world = fractal_noise(shape, scale, octaves, persistence, lacunarity, self.seed, workers=self.workers)
+        return ((world + 1) * 128).astype(np.uint8)
+
+    # tile (tx, ty) of an unbounded world at the given zoom, see perlin.tile_noise
+    def get_noise_tile(self, tx, ty, zoom, tile_size, scale, octaves, persistence, lacunarity):
+        world = tile_noise(tx, ty, zoom, tile_size, scale, octaves, persistence, lacunarity, self.seed)
         return ((world + 1) * 128).astype(np.uint8)
 
-    def assign_colors(self, layers, noise_array, sea_level):
-        altitudes = (layers[:, 2] + sea_level).astype(int)
-        colors = np.array([np.array([*color], dtype=np.uint8) for color in layers[:, 1]])
-        color_indices = np.digitize(noise_array, altitudes)
-        color_array = np.array([colors[ind] for ind in color_indices])
-        return color_array
-
-# Initialize terrain and Pygame
-terrain_generator = TerrainGenerator()
-noise_array = terrain_generator.get_random_noise(scale, (resolution, resolution), octaves, persistence, lacunarity)
-color_array = terrain_generator.assign_colors(layers, noise_array, sea_level)
-
-pygame.init()
-screen = pygame.display.set_mode((width, height))
-pygame.display.set_caption("Zoomable Terrain Map")
-
-running = True
-zoom_level = 1
-dragging = False
-offset_x, offset_y = 0, 0
-
-# Convert NumPy array to Pygame surface
-terrain_surface = pygame.surfarray.make_surface(color_array)
-
-while running:
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        elif event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_LEFT:
-                zoom_level /= zoom_factor
-            elif event.key == pygame.K_RIGHT:
-                zoom_level *= zoom_factor
-            elif event.key == pygame.K_r:
-                # Regenerate noise array on 'r' key press
-                noise_array = terrain_generator.get_random_noise(scale, (resolution, resolution), octaves, persistence, lacunarity)
-                color_array = terrain_generator.assign_colors(layers, noise_array, sea_level)
-                terrain_surface = pygame.surfarray.make_surface(color_array)
-            elif event.key == pygame.K_q:
-                # Quit on 'q' key press
+    # out: optional uint8 (height, width, 3) buffer to colour into
+    def assign_colors(self, layers, noise_array, sea_level, out=None):
+        return palette_for(layers, sea_level).apply(noise_array, out=out)
+
+# tile level for a zoom (screen pixels per world pixel): tiles at level z
+# hold 2**z texels per world pixel, so they are drawn at 0.7x..1.4x
+def tile_level(zoom_level):
+    return min(max_tile_zoom, max(min_tile_zoom, round(math.log2(zoom_level))))
+
+
+# tiles of one level covering the screen plus the prefetch ring, nearest to
+# the centre of the screen first
+def wanted_tiles(seed, level, tile_px, offset_x, offset_y):
+    x0 = math.floor(-offset_x / tile_px) - prefetch_ring
+    x1 = math.floor((width - offset_x) / tile_px) + prefetch_ring
+    y0 = math.floor(-offset_y / tile_px) - prefetch_ring
+    y1 = math.floor((height - offset_y) / tile_px) + prefetch_ring
+    cx = (width / 2 - offset_x) / tile_px - 0.5
+    cy = (height / 2 - offset_y) / tile_px - 0.5
+    # never more than about max_wanted_tiles, however small the tiles get
+    reach = math.isqrt(max_wanted_tiles) // 2
+    x0, x1 = max(x0, math.floor(cx) - reach), min(x1, math.floor(cx) + reach + 1)
+    y0, y1 = max(y0, math.floor(cy) - reach), min(y1, math.floor(cy) + reach + 1)
+    tiles = [(tx, ty) for tx in range(x0, x1 + 1) for ty in range(y0, y1 + 1)]
+    tiles.sort(key=lambda t: (t[0] - cx) ** 2 + (t[1] - cy) ** 2)
+    return [(seed, level, tx, ty) for tx, ty in tiles[:max_wanted_tiles]]
+
+
+def main():
+    world_seed = seed
+
+    pygame.init()
+    screen = pygame.display.set_mode((width, height))
+    pygame.display.set_caption("Zoomable Terrain Map")
+
+    terrain_generator = TerrainGenerator(world_seed)
+    loader = TileLoader((terrain_generator, tile_size, scale, octaves, persistence, lacunarity, layers, sea_level))
+    cache = TileCache(cache_bytes)
+    clock = pygame.time.Clock()
+
+    running = True
+    zoom_level = 1
+    dragging = False
+    # screen position of the world origin
+    offset_x, offset_y = 0, 0
+    redraw = True
+
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
                 running = False
-        elif event.type == pygame.MOUSEBUTTONDOWN:
-            if event.button == 1:  # Left mouse button
-                dragging = True
-                start_x, start_y = event.pos
-        elif event.type == pygame.MOUSEBUTTONUP:
-            if event.button == 1:
-                dragging = False
-        elif event.type == pygame.MOUSEMOTION:
-            if dragging:
-                dx, dy = event.rel
-                offset_x += dx
-                offset_y += dy
-    
-    screen.fill((255, 255, 255))
-
-    zoomed_width = int(width * zoom_level)
-    zoomed_height = int(height * zoom_level)
-
-    # Scale and move the terrain surface
-    zoomed_terrain_surface = pygame.transform.scale(terrain_surface, (zoomed_width, zoomed_height))
-    zoomed_terrain_rect = zoomed_terrain_surface.get_rect()
-    zoomed_terrain_rect.topleft = (offset_x, offset_y)
-
-    # Draw the scaled and moved surface on the screen
-    screen.blit(zoomed_terrain_surface, zoomed_terrain_rect)
-
-    pygame.display.flip()
-
-pygame.quit()
+            elif event.type == pygame.KEYDOWN:
+                if event.key in (pygame.K_LEFT, pygame.K_RIGHT):
+                    # zoom about the centre of the screen
+                    # kept within the tile levels, so tiles never shrink below
+                    # or grow beyond 0.7x..1.4x of their size
+                    factor = 1 / zoom_factor if event.key == pygame.K_LEFT else zoom_factor
+                    new_zoom = min(2.0 ** max_tile_zoom, max(2.0 ** min_tile_zoom, zoom_level * factor))
+                    factor = new_zoom / zoom_level
+                    zoom_level = new_zoom
+                    offset_x = width / 2 - (width / 2 - offset_x) * factor
+                    offset_y = height / 2 - (height / 2 - offset_y) * factor
+                    redraw = True
+                elif event.key == pygame.K_r:
+                    # New world on 'r' key press, generated in the background
+                    world_seed = np.random.randint(1, 100)
+                    terrain_generator = TerrainGenerator(world_seed)
+                    loader.settings = (terrain_generator,) + loader.settings[1:]
+                    redraw = True
+                elif event.key == pygame.K_q:
+                    # Quit on 'q' key press
+                    running = False
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                if event.button == 1:  # Left mouse button
+                    dragging = True
+            elif event.type == pygame.MOUSEBUTTONUP:
+                if event.button == 1:
+                    dragging = False
+            elif event.type == pygame.MOUSEMOTION:
+                if dragging:
+                    dx, dy = event.rel
+                    offset_x += dx
+                    offset_y += dy
+                    redraw = True
+            elif event.type == pygame.WINDOWEXPOSED:
+                redraw = True
+
+        level = tile_level(zoom_level)
+        tile_px = tile_size * zoom_level / 2 ** level
+        wanted = wanted_tiles(world_seed, level, tile_px, offset_x, offset_y)
+        loader.request(wanted)
+        for key, color_array in loader.poll(cache):
+            # arrays are (row, col); surfaces are (x, y)
+            cache.put(key, MipPyramid(pygame.surfarray.make_surface(color_array.swapaxes(0, 1))))
+            redraw = True
+
+        # nothing moved and no tile arrived: keep the last frame on screen
+        if redraw:
+            screen.fill(placeholder_color)
+            for key in wanted:
+                _, _, tx, ty = key
+                left = math.floor(offset_x + tx * tile_px)
+                top = math.floor(offset_y + ty * tile_px)
+                size = (math.floor(offset_x + (tx + 1) * tile_px) - left,
+                        math.floor(offset_y + (ty + 1) * tile_px) - top)
+                if left >= width or top >= height or left + size[0] <= 0 or top + size[1] <= 0:
+                    continue
+                rect = pygame.Rect((left, top), size)
+                tile = cache.get(key)
+                if tile is None:
+                    # placeholder: the coarser tile covering this one, if cached,
+                    # drawn at its own place and clipped to this tile
+                    parent = cache.peek((world_seed, level - 1, tx // 2, ty // 2))
+                    if parent is None:
+                        continue
+                    parent_left = math.floor(offset_x + (tx // 2) * 2 * tile_px)
+                    parent_top = math.floor(offset_y + (ty // 2) * 2 * tile_px)
+                    parent_rect = pygame.Rect(parent_left, parent_top,
+                                              math.floor(offset_x + (tx // 2 + 1) * 2 * tile_px) - parent_left,
+                                              math.floor(offset_y + (ty // 2 + 1) * 2 * tile_px) - parent_top)
+                    parent.draw(screen, parent_rect, clip=rect)
+                    continue
+                # only the on-screen part, from the pyramid level nearest the tile's size
+                tile.draw(screen, rect)
+            pygame.display.flip()
+            redraw = False
+
+        clock.tick(60)
+
+    loader.shutdown()
+    pygame.quit()
+
+
+# the tile workers re-import this file on platforms that spawn processes
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# Headless batch generation: every combination of a parameter grid, on a
+# process pool, written as PNG and/or compressed npz.
+#
+# Each setting takes a single value, a list (30,45,60), a range (1-100) or a
+# stepped range (10-50:10), all in the GUIs' slider units. Maps that only
+# differ in sea level share one heightmap. Outputs are named after their
+# settings and written under a temporary name first, so a rerun skips
+# everything already finished and an interrupted run just picks up the rest.
+#
+#   python batch_generate.py out --seed 1-500 --octaves 4,6,8 --format png,npz
+
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from PIL.Image import fromarray
+from perlin import fractal_noise
+from palette import palette_for, LAYERS
+
+FORMATS = ("png", "npz")
+# settings swept, in file name order
+NOISE_KEYS = ("height", "width", "seed", "scale", "octaves", "persistence", "lacunarity")
+
+
+def parse_values(spec):
+    # "45" / "30,45,60" / "1-100" / "10-50:10" -> sorted list of ints
+    values = set()
+    for item in spec.split(","):
+        item = item.strip()
+        step = 1
+        if ":" in item:
+            item, step = item.split(":")
+            step = int(step)
+        if "-" in item:
+            low, high = item.split("-")
+            values.update(range(int(low), int(high) + 1, step))
+        else:
+            values.add(int(item))
+    return sorted(values)
+
+
+def map_name(noise_settings, sea_level):
+    return "h{}_w{}_seed{}_sc{}_o{}_p{}_l{}_sea{}".format(*noise_settings, sea_level)
+
+
+def output_paths(out_dir, noise_settings, sea_level, formats):
+    name = map_name(noise_settings, sea_level)
+    return {fmt: os.path.join(out_dir, name + "." + fmt) for fmt in formats}
+
+
+def generate(noise_settings, sea_levels, out_dir, formats, png_compression=6):
+    # worker side: one heightmap, coloured and saved at every sea level
+    height, width, seed, scale, octaves, persistence, lacunarity = noise_settings
+    world = fractal_noise((height, width), width * (scale / 100), octaves, persistence / 100,
+                          lacunarity / 10, seed)
+    noise_array = ((world + 1) * 128).astype(np.uint8)
+    del world
+    for sea_level in sea_levels:
+        paths = output_paths(out_dir, noise_settings, sea_level, formats)
+        color_array = palette_for(LAYERS, sea_level).apply(noise_array)
+        # written under a temporary name, so only complete files count as done
+        if "npz" in paths:
+            settings = dict(zip(NOISE_KEYS, noise_settings), sea_level=sea_level)
+            with open(paths["npz"] + ".part", "wb") as f:
+                np.savez_compressed(f, heightmap=noise_array, colors=color_array, **settings)
+            os.replace(paths["npz"] + ".part", paths["npz"])
+        if "png" in paths:
+            fromarray(color_array, mode="RGB").save(paths["png"] + ".part", format="PNG",
+                                                    compress_level=png_compression)
+            os.replace(paths["png"] + ".part", paths["png"])
+    return len(sea_levels), noise_array.size * len(sea_levels)
+
+
+def plan(grid, out_dir, formats):
+    # -> [(noise_settings, sea_levels still to do)], number of maps skipped
+    jobs = []
+    skipped = 0
+    for noise_settings in itertools.product(*(grid[key] for key in NOISE_KEYS)):
+        todo = []
+        for sea_level in grid["sea_level"]:
+            if all(os.path.exists(path) for path in output_paths(out_dir, noise_settings, sea_level, formats).values()):
+                skipped += 1
+            else:
+                todo.append(sea_level)
+        if todo:
+            jobs.append((noise_settings, todo))
+    return jobs, skipped
+
+
+def run(grid, out_dir, formats, workers=None, png_compression=6, progress=None):
+    if min(grid["seed"]) <= 0:
+        raise ValueError("batch seeds have to be fixed (> 0) so the outputs can be found again")
+    os.makedirs(out_dir, exist_ok=True)
+    jobs, skipped = plan(grid, out_dir, formats)
+    maps = pixels = 0
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(generate, noise_settings, sea_levels, out_dir, formats, png_compression)
+                   for noise_settings, sea_levels in jobs]
+        for k, future in enumerate(as_completed(futures), 1):
+            done, done_pixels = future.result()
+            maps += done
+            pixels += done_pixels
+            if progress is not None:
+                progress(k, len(futures))
+    return maps, pixels, skipped, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate every map of a parameter grid without a GUI")
+    parser.add_argument("out", help="output directory")
+    parser.add_argument("--height", default="500")
+    parser.add_argument("--width", default="1000")
+    parser.add_argument("--seed", default="1-10", help="fixed seeds, e.g. 1-1000")
+    parser.add_argument("--sea-level", default="120")
+    parser.add_argument("--scale", default="45")
+    parser.add_argument("--octaves", default="6")
+    parser.add_argument("--persistence", default="55")
+    parser.add_argument("--lacunarity", default="20")
+    parser.add_argument("--format", default="png", help="png, npz or png,npz")
+    parser.add_argument("--workers", type=int, default=None, help="processes, default every core")
+    parser.add_argument("--png-compression", type=int, default=6, help="0 (fast, big) to 9")
+    args = parser.parse_args()
+
+    formats = tuple(fmt.strip() for fmt in args.format.split(","))
+    for fmt in formats:
+        if fmt not in FORMATS:
+            parser.error("unknown format {}, use {}".format(fmt, " / ".join(FORMATS)))
+    grid = {key: parse_values(getattr(args, key)) for key in NOISE_KEYS + ("sea_level",)}
+
+    def progress(done, total):
+        print("\r{}/{} heightmaps ".format(done, total), end="", flush=True)
+
+    maps, pixels, skipped, elapsed = run(grid, args.out, formats, args.workers, args.png_compression, progress)
+    elapsed = max(elapsed, 1e-9)
+    print("\n{} maps in {:.1f} s ({:.2f} maps/s, {:.1f} MPixel/s), {} already done".format(
+        maps, elapsed, maps / elapsed, pixels / 1e6 / elapsed, skipped))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,54 +2,57 @@ from tkinter import *
 from tkinter.filedialog import asksaveasfilename
 from PIL.Image import fromarray
 from PIL import ImageTk
-import noise
 import numpy as np
-import time
+from perlin import fractal_noise, tile_noise, OctaveCache
+from palette import palette_for
+from mesh_decimation import decimate, triangle_colors
+from mesh_export import export_mesh
+from profiling import profiler
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 
 
-
-# for measuring time
-def timing(f):
-    def wrap(*args, **kwargs):
-        time1 = time.time()
-        ret = f(*args, **kwargs)
-        time2 = time.time()
-        print('{:s} function took {:.3f} ms'.format(f.__name__, (time2-time1)*1000.0))
-        return ret
-    return wrap
-
 WHT = "#eeeeee"
 FONT = ("Tahoma","15")
 FONT2 = ("Tahoma", "8")
+# triangles drawn by the 3D view, whatever the map size
+TRIANGLE_BUDGET = 20000
 
 
 class Generator:
-    def __init__(self):
-        pass
+    # workers: processes used by get_random_noise, 1 = serial, None = every core
+    # keep_octaves: keep the last map's octave layers so octave/persistence
+    # edits only compute the difference (serial mode)
+    def __init__(self, workers=1, keep_octaves=False):
+        self.workers = workers
+        self.octave_cache = OctaveCache() if keep_octaves else None
 
     def get_random_noise(self, scale, shape, octaves, persistence, lacunarity, seed=False):
         scale = shape[1] * (scale / 100)
         persistence /= 100
         lacunarity /= 10
-        world = np.zeros(shape)
         if seed == False or seed <= 0: seed = np.random.randint(1,100)
-        for i in range(shape[0]):
-            for j in range(shape[1]):
-                world[i][j] = noise.pnoise2(i / scale, j / scale,
-                                            octaves=octaves,
-                                            persistence=persistence,
-                                            lacunarity=lacunarity,
-                                            base=seed)
+        if self.octave_cache is not None and self.workers == 1:
+            world = self.octave_cache.fractal_noise(shape, scale, octaves, persistence, lacunarity, seed)
+        else:
+            world = fractal_noise(shape, scale, octaves, persistence, lacunarity, seed, workers=self.workers)
+        return ((world + 1) * 128).astype(np.uint8)
+
+    # tile (tx, ty) of an unbounded world at the given zoom (2**zoom pixels per
+    # world pixel), in the same slider units as get_random_noise; scale is a
+    # percentage of width, so zoom-0 tiles line up with a width-wide map
+    def get_noise_tile(self, tx, ty, zoom, tile_size, scale, width, octaves, persistence, lacunarity, seed):
+        if seed <= 0:
+            raise ValueError("tiles of one world need a fixed seed > 0")
+        scale = width * (scale / 100)
+        persistence /= 100
+        lacunarity /= 10
+        world = tile_noise(tx, ty, zoom, tile_size, scale, octaves, persistence, lacunarity, seed)
         return ((world + 1) * 128).astype(np.uint8)
 
-    def assign_colors(self, layers, noise_array, sea_level):
-        altitudes = (layers[:, 2] + sea_level).astype(int)
-        colors = np.array([np.array([*color], dtype=np.uint8) for color in layers[:, 1]])
-        color_indices = np.digitize(noise_array, altitudes)
-        color_array = np.array([colors[ind] for ind in color_indices])
-        return color_array
+    # out: optional uint8 (height, width, 3) buffer to colour into
+    def assign_colors(self, layers, noise_array, sea_level, out=None):
+        return palette_for(layers, sea_level).apply(noise_array, out=out)
 
     def noise_array_to_image(self,noise_world):
         return fromarray(noise_world, mode="L")
@@ -63,7 +66,7 @@ class App:
         self.stg = stg
         self.layers = layers
 
-        self.gen = Generator()
+        self.gen = Generator(keep_octaves=True)
 
         height,width = self.master.winfo_screenheight(),self.master.winfo_screenwidth()
         # default, min, max
@@ -77,6 +80,8 @@ class App:
 
         self.image = None
         self.tk_image = None
+        self.noise_array = None
+        self.color_array = None
         self.bg_label = Label(self.master, background="white", image=self.tk_image)
 
         self.frm = {}
@@ -86,6 +91,7 @@ class App:
         self.wid["generate"] = Button(self.master, text="Generate", font=FONT, bg=WHT, activebackground=WHT, relief=SOLID,command=self.generate)
         self.wid["show"] = Button(self.master, text="Show settings", font=FONT2, bg=WHT, activebackground=WHT, relief=SOLID,command=self.show_frames)
         self.wid["save"] = Button(self.master, text="Save image", font=FONT2, bg=WHT, activebackground=WHT, relief=SOLID,command=self.save)
+        self.wid["export"] = Button(self.master, text="Export mesh", font=FONT2, bg=WHT, activebackground=WHT, relief=SOLID,command=self.export)
 
 
         for key in self.stg:
@@ -115,48 +121,49 @@ class App:
             self.wid[key].delete(0, "end")
             self.wid[key].insert(0, self.stg[key][0])
 
-    def visualize_3d(self, noise_array, color_array):
+    def visualize_3d(self, noise_array, color_array, sea_level=None):
         fig = plt.figure()
         ax = fig.add_subplot(111, projection='3d')
 
-        height, width = noise_array.shape
-        x = np.arange(0, width, 1)
-        y = np.arange(0, height, 1)
-
-        X, Y = np.meshgrid(x, y)
-        Z = noise_array
-
-        # Map colors for the 3D plot based on the color_array
-        color_mapping = np.array(color_array).reshape((height, width, 3)) / 255.0
-
-        ax.plot_surface(X, Y, Z, facecolors=color_mapping, rstride=1, cstride=1, antialiased=False, shade=False)
+        # a decimated mesh instead of two triangles per pixel
+        with profiler.stage("plot3d"):
+            x, y, z, triangles = decimate(noise_array, TRIANGLE_BUDGET, sea_level)
+            surface = ax.plot_trisurf(x, y, z, triangles=triangles, antialiased=False, shade=False)
+            surface.set_facecolor(triangle_colors(color_array, x, y, triangles))
 
         plt.show()
 
-    @timing
     def generate(self):
         self.get_inputs()
 
-        noise_array = self.gen.get_random_noise(
-            self.stg["scale"][0], (self.stg["height"][0], self.stg["width"][0]),
-            self.stg["octaves"][0], self.stg["persistence"][0], self.stg["lacunarity"][0],
-            seed=self.stg["seed"][0]
-        )
-
-        color_array = self.gen.assign_colors(layers, noise_array, self.stg["sea_level"][0])
-        self.image = self.gen.color_array_to_image(color_array)
-        self.tk_image = ImageTk.PhotoImage(self.image)
-        self.bg_label.config(image=self.tk_image)
+        # the 3D window below blocks until closed, so it is timed on its own
+        with profiler.stage("generate", report=True):
+            with profiler.stage("noise"):
+                noise_array = self.gen.get_random_noise(
+                    self.stg["scale"][0], (self.stg["height"][0], self.stg["width"][0]),
+                    self.stg["octaves"][0], self.stg["persistence"][0], self.stg["lacunarity"][0],
+                    seed=self.stg["seed"][0]
+                )
+
+            with profiler.stage("colors"):
+                color_array = self.gen.assign_colors(layers, noise_array, self.stg["sea_level"][0])
+            self.noise_array, self.color_array = noise_array, color_array
+            with profiler.stage("image"):
+                self.image = self.gen.color_array_to_image(color_array)
+            with profiler.stage("photoimage"):
+                self.tk_image = ImageTk.PhotoImage(self.image)
+            self.bg_label.config(image=self.tk_image)
 
         self.master.geometry(str(self.stg["width"][0]) + "x" + str(self.stg["height"][0]))
 
         # Visualize in 3D with the same colors
-        self.visualize_3d(noise_array, color_array)
+        self.visualize_3d(noise_array, color_array, self.stg["sea_level"][0])
 
     def draw(self):
         self.bg_label.place(x=0, y=0, relwidth=1, relheight=1)
         self.wid["generate"].pack(anchor=NE, padx=15, pady=15)
         self.wid["save"].pack(anchor=NE, padx=15, pady=5)
+        self.wid["export"].pack(anchor=NE, padx=15, pady=5)
         self.wid["show"].pack(anchor=NE, padx=15, pady=5)
 
         for name in self.frm:
@@ -185,6 +192,17 @@ class App:
         if dir:
             self.image.save(dir+".png")
 
+    def export(self):
+        # full resolution mesh for game engines, .glb unless .ply is chosen
+        if self.noise_array is None:
+            return
+        dir = asksaveasfilename(
+            title="Export your terrain", defaultextension=".glb",
+            filetypes=[("binary glTF", "*.glb"), ("PLY", "*.ply")]
+        )
+        if dir:
+            export_mesh(dir, self.noise_array, self.color_array)
+
 # (default, min, max)
 stg = {
     "height": [0, 0, 0],  # resolution
@@ -0,0 +1,66 @@
+# Adaptive decimation of a heightmap into a small triangle mesh.
+#
+# plot_surface with rstride=1, cstride=1 draws two triangles per pixel. Here the
+# heightmap is reduced to about `budget` triangles instead: a coarse regular
+# grid keeps the outline and large shapes, and the rest of the vertices are
+# drawn where the terrain bends most (|laplacian| + |gradient|), with sea
+# pixels weighted down so flat water gets few triangles. The vertices are
+# Delaunay-triangulated, which gives about two triangles per vertex.
+
+import numpy as np
+import matplotlib.tri as mtri
+
+# share of the vertices spent on the regular grid
+GRID_SHARE = 0.25
+# importance multiplier for pixels below sea level
+SEA_WEIGHT = 0.05
+
+
+def importance(noise_array, sea_level=None):
+    z = noise_array.astype(np.float32)
+    padded = np.pad(z, 1, mode="edge")
+    laplacian = (padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:]) - 4 * z
+    gradient = np.abs(padded[2:, 1:-1] - padded[:-2, 1:-1]) + np.abs(padded[1:-1, 2:] - padded[1:-1, :-2])
+    weight = np.abs(laplacian) + 0.5 * gradient + 1e-3
+    if sea_level is not None:
+        weight[noise_array < sea_level] *= SEA_WEIGHT
+    return weight
+
+
+def decimate(noise_array, budget=20000, sea_level=None, seed=0):
+    # -> x (column), y (row), z and (n, 3) triangle vertex indices
+    height, width = noise_array.shape
+    n_vertices = max(4, budget // 2)
+    if n_vertices >= height * width:
+        rows, cols = np.divmod(np.arange(height * width), width)
+    else:
+        # regular grid including the last row and column, so the hull is the full rectangle
+        n_grid = max(4, int(n_vertices * GRID_SHARE))
+        step = max(1, int(np.sqrt(height * width / n_grid)))
+        grid_rows = np.unique(np.append(np.arange(0, height, step), height - 1))
+        grid_cols = np.unique(np.append(np.arange(0, width, step), width - 1))
+        taken = np.zeros((height, width), dtype=bool)
+        taken[np.ix_(grid_rows, grid_cols)] = True
+
+        # weighted sampling without replacement (Efraimidis-Spirakis): the
+        # largest u ** (1 / w) win, so busy terrain gets most of the rest
+        weight = importance(noise_array, sea_level).ravel()
+        keys = np.random.default_rng(seed).random(weight.size) ** (1 / weight)
+        keys[taken.ravel()] = -1
+        n_rest = max(0, min(n_vertices - int(taken.sum()), weight.size - int(taken.sum())))
+        if n_rest:
+            taken.ravel()[np.argpartition(keys, -n_rest)[-n_rest:]] = True
+        rows, cols = np.nonzero(taken)
+
+    x = cols.astype(np.float64)
+    y = rows.astype(np.float64)
+    z = noise_array[rows, cols].astype(np.float64)
+    triangles = mtri.Triangulation(x, y).triangles
+    return x, y, z, triangles
+
+
+def triangle_colors(color_array, x, y, triangles):
+    # colour of the pixel under each triangle's centroid, as 0..1 RGB
+    rows = np.rint(y[triangles].mean(axis=1)).astype(np.intp)
+    cols = np.rint(x[triangles].mean(axis=1)).astype(np.intp)
+    return np.asarray(color_array)[rows, cols] / 255.0
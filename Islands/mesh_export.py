@@ -0,0 +1,207 @@
+# Heightmap -> indexed triangle mesh with per-vertex colours, as binary PLY
+# or binary glTF (.glb), for game engines and DCC tools.
+#
+# Every pixel becomes a vertex (or every step-th pixel) and every grid cell two
+# triangles. Vertex and index buffers are built with NumPy a band of rows at a
+# time and written straight to the file, so beyond the inputs the export only
+# holds one band (a few MB). The inputs can be np.memmaps, world_export's files
+# say: an 8k x 8k world goes to a 2.7 GB .glb in about 6 s that way.
+#
+# PLY is z-up (x = column, y = row, z = height), glTF is y-up
+# (x = column, y = height, z = row); both wind their triangles to face up.
+#
+#   python mesh_export.py out/world out/world.glb --step 2
+
+import argparse
+import json
+import struct
+import time
+import numpy as np
+
+# vertices per band; faces are written in bands of the same rows
+BAND_PIXELS = 1 << 18
+
+PLY_VERTEX = np.dtype([
+    ("x", "<f4"), ("y", "<f4"), ("z", "<f4"),
+    ("red", "u1"), ("green", "u1"), ("blue", "u1"),
+])
+PLY_FACE = np.dtype([("n", "u1"), ("v", "<u4", (3,))])
+
+GLB_MAGIC = 0x46546C67
+GLB_JSON = 0x4E4F534A
+GLB_BIN = 0x004E4942
+# glTF componentType / target codes
+FLOAT, UNSIGNED_BYTE, UNSIGNED_INT = 5126, 5121, 5125
+ARRAY_BUFFER, ELEMENT_ARRAY_BUFFER = 34962, 34963
+
+
+def _grid(noise_array, step):
+    rows = np.arange(0, noise_array.shape[0], step)
+    cols = np.arange(0, noise_array.shape[1], step)
+    return rows, cols
+
+
+def _bands(n_rows, n_cols):
+    step = max(2, BAND_PIXELS // max(1, n_cols))
+    for start in range(0, n_rows, step):
+        yield start, min(start + step, n_rows)
+
+
+def _band(array, start, stop, step):
+    # grid rows start..stop of a full-size array, every step-th pixel
+    return np.asarray(array[start * step:stop * step:step, ::step])
+
+
+def _band_vertices(noise_array, rows, cols, start, stop, step, height_scale):
+    # -> x, y (row) and height of the vertices in grid rows start..stop, float32 (n,)
+    heights = _band(noise_array, start, stop, step).astype(np.float32)
+    x = np.broadcast_to(cols.astype(np.float32), heights.shape)
+    y = np.broadcast_to(rows[start:stop].astype(np.float32)[:, None], heights.shape)
+    return x.ravel(), y.ravel(), heights.ravel() * np.float32(height_scale)
+
+
+def _band_faces(start, stop, n_cols, z_up):
+    # the two triangles of every cell whose top-left vertex row is in
+    # start..stop, as uint32 (n, 3) vertex indices
+    top = (np.arange(start, stop, dtype=np.uint32)[:, None] * np.uint32(n_cols)
+           + np.arange(n_cols - 1, dtype=np.uint32)).ravel()
+    below = top + np.uint32(n_cols)
+    faces = np.empty((len(top), 2, 3), dtype=np.uint32)
+    if z_up:
+        faces[:, 0] = np.stack([top, top + 1, below], axis=1)
+        faces[:, 1] = np.stack([top + 1, below + 1, below], axis=1)
+    else:
+        faces[:, 0] = np.stack([top, below, top + 1], axis=1)
+        faces[:, 1] = np.stack([top + 1, below, below + 1], axis=1)
+    return faces.reshape(-1, 3)
+
+
+def _check(noise_array, color_array, step):
+    if noise_array.shape != color_array.shape[:2]:
+        raise ValueError("noise_array and color_array must have the same height and width")
+    rows, cols = _grid(noise_array, step)
+    if len(rows) < 2 or len(cols) < 2:
+        raise ValueError("a mesh needs at least 2x2 vertices")
+    if len(rows) * len(cols) > 2**32 - 1:
+        raise ValueError("too many vertices for 32 bit indices, use a larger step")
+    return rows, cols
+
+
+def write_ply(path, noise_array, color_array, step=1, height_scale=1.0):
+    rows, cols = _check(noise_array, color_array, step)
+    n_vertices = len(rows) * len(cols)
+    n_faces = 2 * (len(rows) - 1) * (len(cols) - 1)
+    header = "\n".join([
+        "ply",
+        "format binary_little_endian 1.0",
+        "element vertex {}".format(n_vertices),
+        "property float x", "property float y", "property float z",
+        "property uchar red", "property uchar green", "property uchar blue",
+        "element face {}".format(n_faces),
+        "property list uchar uint vertex_indices",
+        "end_header\n",
+    ])
+    with open(path, "wb") as f:
+        f.write(header.encode("ascii"))
+        for start, stop in _bands(len(rows), len(cols)):
+            band = np.empty((stop - start) * len(cols), dtype=PLY_VERTEX)
+            band["x"], band["y"], band["z"] = _band_vertices(noise_array, rows, cols, start, stop, step, height_scale)
+            colors = _band(color_array, start, stop, step).reshape(-1, 3)
+            band["red"], band["green"], band["blue"] = colors[:, 0], colors[:, 1], colors[:, 2]
+            band.tofile(f)
+        for start, stop in _bands(len(rows) - 1, len(cols)):
+            faces = _band_faces(start, stop, len(cols), z_up=True)
+            band = np.empty(len(faces), dtype=PLY_FACE)
+            band["n"] = 3
+            band["v"] = faces
+            band.tofile(f)
+    return n_vertices, n_faces
+
+
+def write_glb(path, noise_array, color_array, step=1, height_scale=1.0):
+    rows, cols = _check(noise_array, color_array, step)
+    n_vertices = len(rows) * len(cols)
+    n_faces = 2 * (len(rows) - 1) * (len(cols) - 1)
+
+    # buffer layout: positions (vec3 float), colours (vec4 ubyte, vec3 ubyte
+    # would break the 4 byte attribute alignment), indices (uint)
+    position_bytes = n_vertices * 12
+    color_bytes = n_vertices * 4
+    index_bytes = n_faces * 12
+    bin_size = position_bytes + color_bytes + index_bytes
+    if bin_size + 1024 > 2**32 - 1:
+        raise ValueError("mesh too large for a .glb file, use a larger step")
+
+    # POSITION needs its bounds up front, one band at a time
+    low, high = 255, 0
+    for start, stop in _bands(len(rows), len(cols)):
+        _, _, heights = _band_vertices(noise_array, rows, cols, start, stop, step, 1.0)
+        low, high = min(low, float(heights.min())), max(high, float(heights.max()))
+    gltf = {
+        "asset": {"version": "2.0", "generator": "Procedural_Generation_Python mesh_export"},
+        "scene": 0,
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0}],
+        "meshes": [{"primitives": [{"attributes": {"POSITION": 0, "COLOR_0": 1}, "indices": 2, "mode": 4}]}],
+        "buffers": [{"byteLength": bin_size}],
+        "bufferViews": [
+            {"buffer": 0, "byteOffset": 0, "byteLength": position_bytes, "target": ARRAY_BUFFER},
+            {"buffer": 0, "byteOffset": position_bytes, "byteLength": color_bytes, "target": ARRAY_BUFFER},
+            {"buffer": 0, "byteOffset": position_bytes + color_bytes, "byteLength": index_bytes,
+             "target": ELEMENT_ARRAY_BUFFER},
+        ],
+        "accessors": [
+            {"bufferView": 0, "componentType": FLOAT, "count": n_vertices, "type": "VEC3",
+             "min": [float(cols[0]), low * height_scale, float(rows[0])],
+             "max": [float(cols[-1]), high * height_scale, float(rows[-1])]},
+            {"bufferView": 1, "componentType": UNSIGNED_BYTE, "normalized": True, "count": n_vertices, "type": "VEC4"},
+            {"bufferView": 2, "componentType": UNSIGNED_INT, "count": n_faces * 3, "type": "SCALAR"},
+        ],
+    }
+    json_blob = json.dumps(gltf, separators=(",", ":")).encode()
+    json_blob += b" " * (-len(json_blob) % 4)
+
+    with open(path, "wb") as f:
+        f.write(struct.pack("<III", GLB_MAGIC, 2, 12 + 8 + len(json_blob) + 8 + bin_size))
+        f.write(struct.pack("<II", len(json_blob), GLB_JSON))
+        f.write(json_blob)
+        f.write(struct.pack("<II", bin_size, GLB_BIN))
+        for start, stop in _bands(len(rows), len(cols)):
+            x, y, heights = _band_vertices(noise_array, rows, cols, start, stop, step, height_scale)
+            np.stack([x, heights, y], axis=1).tofile(f)
+        for start, stop in _bands(len(rows), len(cols)):
+            band = np.full(((stop - start) * len(cols), 4), 255, dtype=np.uint8)
+            band[:, :3] = _band(color_array, start, stop, step).reshape(-1, 3)
+            band.tofile(f)
+        for start, stop in _bands(len(rows) - 1, len(cols)):
+            _band_faces(start, stop, len(cols), z_up=False).tofile(f)
+    return n_vertices, n_faces
+
+
+def export_mesh(path, noise_array, color_array, step=1, height_scale=1.0):
+    # format from the extension: .ply or .glb
+    if path.lower().endswith(".ply"):
+        return write_ply(path, noise_array, color_array, step, height_scale)
+    if path.lower().endswith(".glb"):
+        return write_glb(path, noise_array, color_array, step, height_scale)
+    raise ValueError("unknown mesh format for {}, use .ply or .glb".format(path))
+
+
+def main():
+    from world_export import open_world
+
+    parser = argparse.ArgumentParser(description="Export a world_export world as a PLY or GLB mesh")
+    parser.add_argument("world", help="world prefix given to world_export.py")
+    parser.add_argument("out", help="output file, .ply or .glb")
+    parser.add_argument("--step", type=int, default=1, help="keep every step-th pixel")
+    parser.add_argument("--height-scale", type=float, default=1.0)
+    args = parser.parse_args()
+
+    heights, colors = open_world(args.world)
+    start = time.time()
+    n_vertices, n_faces = export_mesh(args.out, heights.array(), colors.array(), args.step, args.height_scale)
+    print("{} vertices, {} triangles in {:.1f} s".format(n_vertices, n_faces, time.time() - start))
+
+
+if __name__ == "__main__":
+    main()
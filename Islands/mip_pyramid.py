@@ -0,0 +1,63 @@
+# Mip-mapped level-of-detail pyramid for a pygame surface.
+#
+# Level 0 is the surface itself, every further level is half the size of the
+# one before. draw() picks the coarsest level that still has a texel per screen
+# pixel and scales only the visible part of it, so a frame costs about one
+# screen of pixels whatever the zoom. Zooming in needs no finer levels: the
+# visible part of level 0 just gets smaller.
+#
+# The tiled viewer keeps one pyramid per cached tile, and draws the parent
+# tile's pyramid, clipped to a missing tile, as that tile's placeholder.
+
+import math
+import pygame
+
+# smallest side a level is allowed to shrink to
+MIN_SIDE = 16
+
+
+class MipPyramid:
+    def __init__(self, surface):
+        self.size = surface.get_size()
+        self.levels = [surface]
+        while min(self.levels[-1].get_size()) // 2 >= MIN_SIDE:
+            w, h = self.levels[-1].get_size()
+            self.levels.append(pygame.transform.smoothscale(self.levels[-1], (w // 2, h // 2)))
+        self.nbytes = sum(level.get_width() * level.get_height() * level.get_bytesize() for level in self.levels)
+
+    def level_for(self, zoom_x, zoom_y):
+        # zoom_*: screen pixels per level-0 pixel
+        best = self.levels[0]
+        for level in self.levels[1:]:
+            w, h = level.get_size()
+            if w < self.size[0] * zoom_x or h < self.size[1] * zoom_y:
+                break
+            best = level
+        return best
+
+    def draw(self, screen, rect, clip=None):
+        # rect: where the whole surface lands on screen, usually much larger
+        # than the screen itself when zoomed in; clip: only draw inside this
+        # part of the screen
+        area = screen.get_rect() if clip is None else clip.clip(screen.get_rect())
+        visible = rect.clip(area)
+        if visible.width == 0 or visible.height == 0:
+            return
+        level = self.level_for(rect.width / self.size[0], rect.height / self.size[1])
+        w, h = level.get_size()
+        fx = w / rect.width
+        fy = h / rect.height
+
+        x0 = min(w - 1, int((visible.left - rect.left) * fx))
+        y0 = min(h - 1, int((visible.top - rect.top) * fy))
+        x1 = max(x0 + 1, min(w, math.ceil((visible.right - rect.left) * fx)))
+        y1 = max(y0 + 1, min(h, math.ceil((visible.bottom - rect.top) * fy)))
+
+        # whole texels only, placed where they fall in the full-size rect
+        left = rect.left + round(x0 / fx)
+        top = rect.top + round(y0 / fy)
+        size = (max(1, rect.left + round(x1 / fx) - left), max(1, rect.top + round(y1 / fy) - top))
+        part = level.subsurface((x0, y0, x1 - x0, y1 - y0))
+        # whole texels can stick out of the clip by a pixel or two
+        target = pygame.Rect((left, top), size).clip(area)
+        screen.blit(pygame.transform.scale(part, size), target.topleft, area=target.move(-left, -top))
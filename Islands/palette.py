@@ -0,0 +1,73 @@
+# Precompiled colour palettes for uint8 heightmaps.
+#
+# assign_colors only depends on (layers, sea_level), and a uint8 height can
+# only take 256 values, so the whole mapping is a 256x3 lookup table. Palette
+# builds that table once and colours a map with a single take() per row band.
+
+from collections import OrderedDict
+import threading
+import numpy as np
+
+# name, color, altitude: the default layers used by the apps
+LAYERS = np.array([
+    ["blue1", (22, 156, 233), -10],
+    ["blue2", (45, 166, 235), -5],
+    ["blue3", (68, 176, 238), 0],
+    ["beach", (244, 218, 138), 3],
+    ["green0", (181, 202, 116), 6],
+    ["green1", (116, 186, 94), 25],
+    ["green2", (80, 143, 61), 35],
+    ["green3", (50, 89, 38), 42],
+    ["grey1", (58, 29, 19), 46],
+    ["grey2", (92, 61, 61), 52],
+    ["snow", (245, 240, 240), 255]
+], dtype=object)
+
+# rows per take(), keeps the intp copy numpy makes of the indices in cache
+BAND_PIXELS = 1 << 16
+
+# palettes kept by palette_for, newest last
+CACHE_SIZE = 32
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class Palette:
+    def __init__(self, layers, sea_level):
+        self.sea_level = sea_level
+        altitudes = (layers[:, 2] + sea_level).astype(int)
+        colors = np.array([np.array([*color], dtype=np.uint8) for color in layers[:, 1]])
+        # same bins as np.digitize(noise_array, altitudes) in assign_colors;
+        # heights at or above the top altitude keep the top colour
+        indices = np.digitize(np.arange(256), altitudes)
+        self.lut = colors[np.minimum(indices, len(colors) - 1)]
+
+    def apply(self, noise_array, out=None):
+        # noise_array: uint8 (height, width) -> uint8 (height, width, 3)
+        if out is None:
+            out = np.empty(noise_array.shape + (3,), dtype=np.uint8)
+        if noise_array.ndim < 2:
+            return self.lut.take(noise_array, axis=0, out=out)
+        step = max(1, BAND_PIXELS // max(1, noise_array[0].size))
+        for start in range(0, len(noise_array), step):
+            self.lut.take(noise_array[start:start + step], axis=0, out=out[start:start + step])
+        return out
+
+
+def layers_key(layers):
+    return tuple((str(name), tuple(int(c) for c in color), int(altitude)) for name, color, altitude in layers)
+
+
+# Palette for (layers, sea_level), built once and reused while it stays in
+# the CACHE_SIZE most recently used entries
+def palette_for(layers, sea_level):
+    key = (layers_key(layers), sea_level)
+    with _cache_lock:
+        palette = _cache.get(key)
+        if palette is None:
+            palette = _cache[key] = Palette(layers, sea_level)
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+        else:
+            _cache.move_to_end(key)
+        return palette
@@ -0,0 +1,126 @@
+# Two-stage terrain pipeline: heightmap (noise) -> colours.
+#
+# Heightmaps are kept in a bounded cache keyed on the noise settings, so an
+# edit that only touches the colouring (sea level, layers) re-runs only the
+# cheap colour stage on the cached heightmap.
+
+from collections import OrderedDict
+import threading
+import numpy as np
+from palette import layers_key
+
+
+class HeightmapCache:
+    # max_entries / max_bytes: caps, whichever is hit first evicts
+    # policy: "lru" evicts the least recently used entry, "fifo" the oldest
+    # safe to share between threads (Streamlit sessions, say)
+    def __init__(self, max_entries=16, max_bytes=256 * 2**20, policy="lru"):
+        if policy not in ("lru", "fifo"):
+            raise ValueError("policy must be 'lru' or 'fifo'")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            array = self.entries.get(key)
+            if array is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if self.policy == "lru":
+                self.entries.move_to_end(key)
+            return array
+
+    def put(self, key, array):
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key).nbytes
+            # too big to ever fit: don't flush everything else for it
+            if array.nbytes > self.max_bytes or self.max_entries < 1:
+                return
+            self.entries[key] = array
+            self.nbytes += array.nbytes
+            while len(self.entries) > self.max_entries or self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.nbytes,
+        }
+
+
+def resolve_seed(seed):
+    # the generators' "0 = random" rule, done up front so it can be a cache key
+    if seed == False or seed <= 0:
+        seed = np.random.randint(1, 100)
+    return int(seed)
+
+
+class TerrainPipeline:
+    def __init__(self, generator, cache=None):
+        self.gen = generator
+        self.cache = cache if cache is not None else HeightmapCache()
+        self.seed = None
+        self.last_noise_key = None
+        self.last_color_key = None
+
+    def heightmap(self, shape, scale, octaves, persistence, lacunarity, seed):
+        # seed must already be resolved (> 0)
+        key = (tuple(shape), scale, octaves, persistence, lacunarity, seed)
+        noise_array = self.cache.get(key)
+        if noise_array is None:
+            noise_array = self.gen.get_random_noise(scale, shape, octaves, persistence, lacunarity, seed=seed)
+            # shared between callers through the cache
+            noise_array.setflags(write=False)
+            self.cache.put(key, noise_array)
+        return noise_array
+
+    def colors(self, layers, noise_array, sea_level, out=None):
+        return self.gen.assign_colors(layers, noise_array, sea_level, out=out)
+
+    def choose_seed(self, shape, scale, octaves, persistence, lacunarity, seed, layers, sea_level):
+        # concrete seed for a run with these settings
+        noise_key = (tuple(shape), scale, octaves, persistence, lacunarity)
+        color_key = (layers_key(layers), sea_level)
+        if seed == False or seed <= 0:
+            # random seed: keep the current world while settings are being
+            # tuned, draw a new one on a plain re-roll (nothing changed)
+            changed = (noise_key, color_key) != (self.last_noise_key, self.last_color_key)
+            if self.seed is not None and changed:
+                seed = self.seed
+            else:
+                seed = resolve_seed(seed)
+        self.seed = seed
+        self.last_noise_key = noise_key
+        self.last_color_key = color_key
+        return seed
+
+    def has_heightmap(self, shape, scale, octaves, persistence, lacunarity, seed):
+        return (tuple(shape), scale, octaves, persistence, lacunarity, seed) in self.cache
+
+    def run(self, shape, scale, octaves, persistence, lacunarity, seed, layers, sea_level):
+        seed = self.choose_seed(shape, scale, octaves, persistence, lacunarity, seed, layers, sea_level)
+        noise_array = self.heightmap(shape, scale, octaves, persistence, lacunarity, seed)
+        color_array = self.colors(layers, noise_array, sea_level)
+        return noise_array, color_array
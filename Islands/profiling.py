@@ -0,0 +1,259 @@
+# Per-stage instrumentation: wall time, CPU time and (optionally) peak traced
+# memory of named stages such as noise, colours or the PIL conversion.
+#
+#   with profiler.stage("noise"):
+#       noise_array = ...
+#
+#   @profiler.profile("render")
+#   def render(...): ...
+#
+# Off by default: a disabled stage() hands back one shared do-nothing context
+# manager, so instrumented code costs a method call per stage. Stages opened
+# with report=True (the ones the old timing decorator wrapped) still print
+# their wall time when off. Turned on by the environment, for any of the apps:
+#
+#   PROFILE=1        wall and CPU (thread) time
+#   PROFILE=memory   also the tracemalloc peak of each stage (slows numpy code)
+#   PROFILE_OUT=run  at exit, write run.json (summary) and run.trace.json
+#                    (Chrome trace: chrome://tracing or ui.perfetto.dev)
+#
+# Each stage keeps its last `window` samples, from which summary() builds
+# percentiles and a log2 histogram of the wall time. Outermost stages are
+# printed as they finish, like the old timing decorator.
+#
+# tracemalloc's peak is process-wide, so only one thread measures memory at a
+# time: the first to open a stage owns the peak counter until that stage
+# ends, and stages other threads run meanwhile record no peak. Allocations
+# by other threads still count towards the owner's peak, so the figures are
+# exact only while one thread at a time does the work.
+
+from collections import deque
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# wall time histogram buckets: < 1 ms, < 2 ms, < 4 ms ... < 2**(BUCKETS - 1) ms, longer
+BUCKETS = 16
+
+
+class _Off:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_OFF = _Off()
+
+
+class _Report:
+    # a disabled profiler's report=True stage: wall time, printed
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        print('{:s} function took {:.3f} ms'.format(self.name, (time.perf_counter() - self.start) * 1000.0))
+        return False
+
+
+class _Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.peak = 0
+        self.tracked = False
+        self.owner = False
+
+    def __enter__(self):
+        profiler = self.profiler
+        self.stack = profiler._stack()
+        if profiler.memory:
+            thread = threading.get_ident()
+            with profiler.lock:
+                if profiler.memory_owner is None:
+                    profiler.memory_owner = thread
+                    self.owner = True
+                self.tracked = profiler.memory_owner == thread
+        if self.tracked:
+            # nested stages reset the peak counter, so fold it into the
+            # enclosing stages first
+            current, peak = tracemalloc.get_traced_memory()
+            for outer in self.stack:
+                if outer.tracked:
+                    outer.peak = max(outer.peak, peak)
+            tracemalloc.reset_peak()
+            self.base = self.peak = current
+        self.stack.append(self)
+        self.cpu = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start
+        cpu = time.thread_time() - self.cpu
+        self.stack.pop()
+        peak = None
+        if self.tracked:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            for outer in self.stack:
+                if outer.tracked:
+                    outer.peak = max(outer.peak, self.peak)
+            peak = self.peak - self.base
+        if self.owner:
+            with self.profiler.lock:
+                self.profiler.memory_owner = None
+        self.profiler.record(self.name, self.start, wall, cpu, peak, depth=len(self.stack))
+        return False
+
+
+class Profiler:
+    # window: samples kept per stage; max_events: trace events kept
+    def __init__(self, enabled=False, memory=False, window=256, max_events=100000, verbose=True):
+        self.enabled = False
+        self.memory = False
+        self.window = window
+        self.verbose = verbose
+        self.samples = {}
+        self.counts = {}
+        self.events = deque(maxlen=max_events)
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # thread measuring memory right now, see the note at the top
+        self.memory_owner = None
+        if enabled:
+            self.enable(memory)
+
+    def enable(self, memory=False):
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.memory = False
+
+    def _stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def stage(self, name, report=False):
+        # report: print the wall time even when off, like the old timing decorator
+        if not self.enabled:
+            return _Report(name) if report and self.verbose else _OFF
+        return _Stage(self, name)
+
+    def profile(self, name=None, report=False):
+        # decorator form of stage(), named after the function by default
+        def decorate(f):
+            label = name or f.__name__
+
+            @functools.wraps(f)
+            def wrap(*args, **kwargs):
+                if not self.enabled and not (report and self.verbose):
+                    return f(*args, **kwargs)
+                with self.stage(label, report):
+                    return f(*args, **kwargs)
+            return wrap
+        return decorate
+
+    def record(self, name, start, wall, cpu, peak=None, depth=0):
+        with self.lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=self.window)
+                self.counts[name] = 0
+            samples.append((wall, cpu, peak))
+            self.counts[name] += 1
+            self.events.append((name, start, wall, cpu, peak, threading.get_ident()))
+        if self.verbose and depth == 0:
+            line = "{}: wall {:.3f} ms, cpu {:.3f} ms".format(name, wall * 1000, cpu * 1000)
+            if peak is not None:
+                line += ", peak {:.1f} MB".format(peak / 2**20)
+            print(line)
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.counts.clear()
+            self.events.clear()
+
+    def summary(self):
+        # stage -> count and stats (ms / bytes) over its last `window` samples
+        with self.lock:
+            items = [(name, list(samples), self.counts[name]) for name, samples in self.samples.items()]
+        out = {}
+        for name, samples, count in items:
+            walls = sorted(sample[0] * 1000 for sample in samples)
+            cpus = [sample[1] * 1000 for sample in samples]
+            peaks = [sample[2] for sample in samples if sample[2] is not None]
+            histogram = [0] * (BUCKETS + 1)
+            for wall in walls:
+                bucket = 0 if wall < 1 else min(BUCKETS, int(wall).bit_length())
+                histogram[bucket] += 1
+            out[name] = {
+                "count": count,
+                "window": len(samples),
+                "wall_ms": {
+                    "mean": sum(walls) / len(walls),
+                    "p50": walls[len(walls) // 2],
+                    "p95": walls[min(len(walls) - 1, int(len(walls) * 0.95))],
+                    "max": walls[-1],
+                },
+                "cpu_ms": {"mean": sum(cpus) / len(cpus), "max": max(cpus)},
+                "peak_bytes": {"mean": sum(peaks) / len(peaks), "max": max(peaks)} if peaks else None,
+                # bucket k counts walls below 2**k ms (k = 0: below 1 ms), the last one the rest
+                "wall_histogram": histogram,
+            }
+        return out
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def write_chrome_trace(self, path):
+        pid = os.getpid()
+        with self.lock:
+            events = list(self.events)
+        trace = []
+        for name, start, wall, cpu, peak, thread in events:
+            args = {"cpu_ms": cpu * 1000}
+            if peak is not None:
+                args["peak_bytes"] = peak
+            trace.append({
+                "name": name, "ph": "X", "pid": pid, "tid": thread,
+                "ts": (start - self.origin) * 1e6, "dur": wall * 1e6, "args": args,
+            })
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+def _from_environment():
+    setting = os.environ.get("PROFILE", "")
+    enabled = setting not in ("", "0")
+    profiler = Profiler(enabled=enabled, memory=setting == "memory")
+    prefix = os.environ.get("PROFILE_OUT")
+    if enabled and prefix:
+        def dump():
+            profiler.write_json(prefix + ".json")
+            profiler.write_chrome_trace(prefix + ".trace.json")
+        atexit.register(dump)
+    return profiler
+
+
+# the one the apps use
+profiler = _from_environment()
@@ -0,0 +1,142 @@
+# Background tile generation for the unbounded pygame viewer.
+#
+# TileLoader hands tiles to a process pool, nearest-first, and collects the
+# finished colour arrays without ever blocking the caller; TileCache keeps
+# the resulting tiles (MipPyramids of their surfaces) in LRU order under a
+# memory cap.
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import os
+import time
+
+
+def render_tile(key, generator, tile_size, scale, octaves, persistence, lacunarity, layers, sea_level):
+    # worker side: key = (seed, zoom, tx, ty) -> uint8 (tile_size, tile_size, 3);
+    # generator is anything with get_noise_tile/assign_colors and that seed
+    _, zoom, tx, ty = key
+    noise_array = generator.get_noise_tile(tx, ty, zoom, tile_size, scale, octaves, persistence, lacunarity)
+    return generator.assign_colors(layers, noise_array, sea_level)
+
+
+class TileCache:
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _sizeof(tile):
+        return tile.nbytes
+
+    def get(self, key):
+        surface = self.entries.get(key)
+        if surface is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return surface
+
+    def peek(self, key):
+        # lookup that neither counts nor refreshes, for placeholders
+        return self.entries.get(key)
+
+    def put(self, key, surface):
+        if key in self.entries:
+            self.nbytes -= self._sizeof(self.entries.pop(key))
+        self.entries[key] = surface
+        self.nbytes += self._sizeof(surface)
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= self._sizeof(evicted)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+
+class TileLoader:
+    # settings: the arguments after key that render_tile takes
+    # a tile that fails is reported and retried after a growing delay, up to
+    # max_failures times; after that it stays a placeholder. A pool whose
+    # worker died is replaced, and the tiles it was working on count as failed
+    # (one of them may be what killed it), so a tile that keeps crashing
+    # workers runs out of retries too
+    def __init__(self, settings, workers=None, max_pending=None, max_failures=3):
+        self.settings = settings
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.max_pending = max_pending or self.workers * 2
+        self.max_failures = max_failures
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.pending = {}
+        self.wanted = []
+        # key -> (failures so far, monotonic time it may be tried again)
+        self.failures = {}
+
+    def request(self, keys):
+        # keys in priority order; replaces the previous wish list, and queued
+        # work for tiles that scrolled away is dropped before it starts
+        self.wanted = list(keys)
+        wanted = set(self.wanted)
+        for key, future in list(self.pending.items()):
+            if key not in wanted and future.cancel():
+                del self.pending[key]
+
+    def _failed(self, key, error):
+        count = self.failures.get(key, (0, 0))[0] + 1
+        self.failures[key] = (count, time.monotonic() + 0.5 * 2**count)
+        if count >= self.max_failures:
+            print("tile {} failed {} times, giving up: {!r}".format(key, count, error))
+        else:
+            print("tile {} failed, retrying: {!r}".format(key, error))
+
+    def _restart(self, error):
+        print("tile pool broke, restarting it: {!r}".format(error))
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.pending = {}
+
+    def poll(self, cache):
+        # non-blocking: returns the finished (key, color_array) pairs and
+        # tops the pool up with the next wanted tiles that aren't cached
+        finished = {}
+        broken = None
+        for key, future in list(self.pending.items()):
+            if future.done():
+                del self.pending[key]
+                if future.cancelled():
+                    continue
+                error = future.exception()
+                if error is None:
+                    finished[key] = future.result()
+                    self.failures.pop(key, None)
+                else:
+                    self._failed(key, error)
+                    if isinstance(error, BrokenProcessPool):
+                        broken = error
+        if broken is not None:
+            self._restart(broken)
+
+        now = time.monotonic()
+        for key in self.wanted:
+            if len(self.pending) >= self.max_pending:
+                break
+            if key in self.pending or key in finished or key in cache:
+                continue
+            if key in self.failures:
+                count, retry_at = self.failures[key]
+                if count >= self.max_failures or now < retry_at:
+                    continue
+            try:
+                self.pending[key] = self.pool.submit(render_tile, key, *self.settings)
+            except BrokenProcessPool as error:
+                self._failed(key, error)
+                self._restart(error)
+                break
+        return finished.items()
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
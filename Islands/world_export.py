@@ -0,0 +1,204 @@
+# Out-of-core world export.
+#
+# Writes the heightmap and the coloured map of an arbitrarily large world chunk
+# by chunk into two raw files that any tool can np.memmap:
+#
+#   <prefix>.height   uint8 (height, width)
+#   <prefix>.color    uint8 (height, width, 3)
+#
+# Each file is: a 64 byte header, a JSON blob with the generation settings, a
+# chunk index, then the pixels in plain row-major order at data_offset (4 KiB
+# aligned). The index has one record per chunk_size x chunk_size chunk with
+# its position, min/max height and a done flag, so readers can skip chunks
+# (all sea, say) and an interrupted export can be resumed.
+#
+# Only one band of chunk_size rows is mapped at a time, so peak RSS is about
+# chunk_size * width * 4 bytes plus one chunk of float64 noise.
+#
+#   python world_export.py out/world --height 32768 --width 32768 --seed 7
+
+import argparse
+import json
+import os
+import struct
+import time
+import numpy as np
+from perlin import pnoise2_grid
+from palette import palette_for, LAYERS
+
+MAGIC = b"PGWORLD1"
+VERSION = 1
+# magic, version, height, width, channels, chunk_size, n_chunks, meta_size, index_offset, data_offset
+HEADER = struct.Struct("<8sIIIIIIIQQ")
+HEADER_SIZE = 64
+ALIGN = 4096
+
+INDEX_DTYPE = np.dtype([
+    ("row", "<u4"), ("col", "<u4"), ("rows", "<u4"), ("cols", "<u4"),
+    ("min", "u1"), ("max", "u1"), ("done", "u1"), ("pad", "u1"),
+])
+
+
+def _chunk_grid(height, width, chunk_size):
+    return [(row, col) for row in range(0, height, chunk_size) for col in range(0, width, chunk_size)]
+
+
+class WorldFile:
+    def __init__(self, path, mode="r"):
+        self.path = path
+        with open(path, "rb") as f:
+            head = f.read(HEADER_SIZE)
+            (magic, version, self.height, self.width, self.channels, self.chunk_size,
+             self.n_chunks, meta_size, self.index_offset, self.data_offset) = HEADER.unpack(head[:HEADER.size])
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("{} is not a version {} world file".format(path, VERSION))
+            self.meta = json.loads(f.read(meta_size).decode())
+        self.mode = mode
+        self.index = np.memmap(path, dtype=INDEX_DTYPE, mode=mode, offset=self.index_offset, shape=(self.n_chunks,))
+
+    @property
+    def shape(self):
+        if self.channels == 1:
+            return (self.height, self.width)
+        return (self.height, self.width, self.channels)
+
+    @classmethod
+    def create(cls, path, height, width, channels, chunk_size, meta):
+        meta_blob = json.dumps(meta, sort_keys=True).encode()
+        n_chunks = len(_chunk_grid(height, width, chunk_size))
+        index_offset = HEADER_SIZE + len(meta_blob)
+        index_offset += -index_offset % INDEX_DTYPE.itemsize
+        data_offset = index_offset + n_chunks * INDEX_DTYPE.itemsize
+        data_offset += -data_offset % ALIGN
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, height, width, channels, chunk_size, n_chunks,
+                                len(meta_blob), index_offset, data_offset).ljust(HEADER_SIZE, b"\0"))
+            f.write(meta_blob)
+            # sparse: nothing but the header is written until chunks land
+            f.truncate(data_offset + height * width * channels)
+        world = cls(path, mode="r+")
+        for k, (row, col) in enumerate(_chunk_grid(height, width, chunk_size)):
+            world.index[k] = (row, col, min(chunk_size, height - row), min(chunk_size, width - col), 0, 0, 0, 0)
+        world.index.flush()
+        return world
+
+    def rows(self, start, stop, mode=None):
+        # memmap of rows start..stop only; reading a region never maps the rest
+        row_bytes = self.width * self.channels
+        shape = (stop - start,) + self.shape[1:]
+        return np.memmap(self.path, dtype=np.uint8, mode=mode or self.mode,
+                         offset=self.data_offset + start * row_bytes, shape=shape)
+
+    def read(self, row, col, rows, cols):
+        return np.array(self.rows(row, row + rows)[:, col:col + cols])
+
+    def array(self):
+        # the whole world as one lazily paged array
+        return np.memmap(self.path, dtype=np.uint8, mode="r", offset=self.data_offset, shape=self.shape)
+
+    def chunks(self, min_height=0, max_height=255, done_only=True):
+        # index records whose height range overlaps [min_height, max_height]
+        index = np.asarray(self.index)
+        keep = (index["max"] >= min_height) & (index["min"] <= max_height)
+        if done_only:
+            keep &= index["done"] == 1
+        return index[keep]
+
+
+def open_world(prefix):
+    return WorldFile(prefix + ".height"), WorldFile(prefix + ".color")
+
+
+def _open_or_create(path, channels, height, width, chunk_size, meta, resume):
+    if resume and os.path.exists(path):
+        try:
+            world = WorldFile(path, mode="r+")
+            if world.shape[:2] == (height, width) and world.chunk_size == chunk_size and world.meta == meta:
+                return world
+        except ValueError:
+            pass
+    return WorldFile.create(path, height, width, channels, chunk_size, meta)
+
+
+# scale / octaves / persistence / lacunarity / seed are in the same slider
+# units as Generator.get_random_noise; seed has to be fixed (> 0) and the
+# result matches get_random_noise for the same settings pixel for pixel
+def export_world(prefix, shape, scale, octaves, persistence, lacunarity, seed, layers, sea_level,
+                 chunk_size=512, resume=True, progress=None):
+    if seed <= 0:
+        raise ValueError("an exported world needs a fixed seed > 0")
+    height, width = shape
+    meta = {
+        "scale": scale, "octaves": octaves, "persistence": persistence,
+        "lacunarity": lacunarity, "seed": seed, "sea_level": sea_level,
+        "layers": [[str(name), [int(c) for c in color], int(altitude)] for name, color, altitude in layers],
+    }
+    heights = _open_or_create(prefix + ".height", 1, height, width, chunk_size, meta, resume)
+    colors = _open_or_create(prefix + ".color", 3, height, width, chunk_size, meta, resume)
+    palette = palette_for(layers, sea_level)
+
+    noise_scale = width * (scale / 100)
+    k = 0
+    for row in range(0, height, chunk_size):
+        rows = min(chunk_size, height - row)
+        band_h = band_c = None
+        finished = []
+        xs = np.arange(row, row + rows) / noise_scale
+        for col in range(0, width, chunk_size):
+            cols = min(chunk_size, width - col)
+            if not (heights.index["done"][k] and colors.index["done"][k]):
+                if band_h is None:
+                    band_h = heights.rows(row, row + rows)
+                    band_c = colors.rows(row, row + rows)
+                ys = np.arange(col, col + cols) / noise_scale
+                world = pnoise2_grid(xs, ys, octaves, persistence / 100, lacunarity / 10, base=seed)
+                chunk = ((world + 1) * 128).astype(np.uint8)
+                band_h[:, col:col + cols] = chunk
+                band_c[:, col:col + cols] = palette.apply(chunk)
+                finished.append((k, chunk.min(), chunk.max()))
+            k += 1
+        if band_h is not None:
+            # the pixels reach the disk before the done flags that describe them
+            band_h.flush()
+            band_c.flush()
+            del band_h, band_c
+            for world_file in (heights, colors):
+                for chunk_k, low, high in finished:
+                    world_file.index["min"][chunk_k] = low
+                    world_file.index["max"][chunk_k] = high
+                    world_file.index["done"][chunk_k] = 1
+                world_file.index.flush()
+        if progress is not None:
+            progress(row + rows, height)
+    return heights, colors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a large world to memory-mapped files")
+    parser.add_argument("prefix", help="output path without extension")
+    parser.add_argument("--height", type=int, default=8192)
+    parser.add_argument("--width", type=int, default=8192)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--sea-level", type=int, default=120)
+    parser.add_argument("--scale", type=float, default=45)
+    parser.add_argument("--octaves", type=int, default=6)
+    parser.add_argument("--persistence", type=float, default=55)
+    parser.add_argument("--lacunarity", type=float, default=20)
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--no-resume", action="store_true", help="start over even if the files exist")
+    args = parser.parse_args()
+
+    def progress(done, total):
+        print("\r{:.1f}% ".format(100 * done / total), end="", flush=True)
+
+    start = time.time()
+    export_world(args.prefix, (args.height, args.width), args.scale, args.octaves, args.persistence,
+                 args.lacunarity, args.seed, LAYERS, args.sea_level, chunk_size=args.chunk_size,
+                 resume=not args.no_resume, progress=progress)
+    elapsed = time.time() - start
+    print("\n{}x{} in {:.1f} s ({:.1f} MPixel/s)".format(
+        args.height, args.width, elapsed, args.height * args.width / 1e6 / max(elapsed, 1e-9)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,72 @@
 import streamlit as st
-import noise
 import numpy as np
+import os
+import sys
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 
+# the terrain engine lives next to the desktop versions in ../Islands
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Islands"))
+from perlin import fractal_noise, tile_noise, OctaveCache
+from palette import palette_for
+from mesh_decimation import decimate, triangle_colors
+from profiling import profiler
+
 WHT = "#eeeeee"
 FONT = ("Tahoma", "15")
 FONT2 = ("Tahoma", "8")
+# triangles drawn by the 3D view, whatever the map size
+TRIANGLE_BUDGET = 20000
 
 
 class Generator:
+    # workers: processes used by get_random_noise, 1 = serial, None = every core
+    # keep_octaves: keep the last map's octave layers so octave/persistence
+    # edits only compute the difference (serial mode)
+    def __init__(self, workers=1, keep_octaves=False):
+        self.workers = workers
+        self.octave_cache = OctaveCache() if keep_octaves else None
+
     def get_random_noise(self, scale, shape, octaves, persistence, lacunarity, seed=False):
         scale = shape[1] * (scale / 100)
         persistence /= 100
         lacunarity /= 10
-        world = np.zeros(shape)
         if seed == False or seed <= 0:
             seed = np.random.randint(1, 100)
-        for i in range(shape[0]):
-            for j in range(shape[1]):
-                world[i][j] = noise.pnoise2(i / scale, j / scale,
-                                            octaves=octaves,
-                                            persistence=persistence,
-                                            lacunarity=lacunarity,
-                                            base=seed)
+        if self.octave_cache is not None and self.workers == 1:
+            world = self.octave_cache.fractal_noise(shape, scale, octaves, persistence, lacunarity, seed)
+        else:
+            world = fractal_noise(shape, scale, octaves, persistence, lacunarity, seed, workers=self.workers)
         return ((world + 1) * 128).astype(np.uint8)
 
-    def assign_colors(self, layers, noise_array, sea_level):
-        altitudes = (layers[:, 2] + sea_level).astype(int)
-        colors = np.array([np.array([*color], dtype=np.uint8) for color in layers[:, 1]])
-        color_indices = np.digitize(noise_array, altitudes)
-        color_array = np.array([colors[ind] for ind in color_indices])
-        return color_array
+    # tile (tx, ty) of an unbounded world at the given zoom (2**zoom pixels per
+    # world pixel), in the same slider units as get_random_noise; scale is a
+    # percentage of width, so zoom-0 tiles line up with a width-wide map
+    def get_noise_tile(self, tx, ty, zoom, tile_size, scale, width, octaves, persistence, lacunarity, seed):
+        if seed <= 0:
+            raise ValueError("tiles of one world need a fixed seed > 0")
+        scale = width * (scale / 100)
+        persistence /= 100
+        lacunarity /= 10
+        world = tile_noise(tx, ty, zoom, tile_size, scale, octaves, persistence, lacunarity, seed)
+        return ((world + 1) * 128).astype(np.uint8)
+
+    # out: optional uint8 (height, width, 3) buffer to colour into
+    def assign_colors(self, layers, noise_array, sea_level, out=None):
+        return palette_for(layers, sea_level).apply(noise_array, out=out)
 
     
 
 
-def visualize_3d(noise_array, color_array):
+def visualize_3d(noise_array, color_array, sea_level=None):
     fig = plt.figure()
     ax = fig.add_subplot(111, projection='3d')
 
-    height, width = noise_array.shape
-    x = np.arange(0, width, 1)
-    y = np.arange(0, height, 1)
-
-    X, Y = np.meshgrid(x, y)
-    Z = noise_array
-
-    # Map colors for the 3D plot based on the color_array
-    color_mapping = np.array(color_array).reshape((height, width, 3)) / 255.0
-
-    # Plot the 3D surface with color mapping
-    ax.plot_surface(X, Y, Z, facecolors=color_mapping, rstride=1, cstride=1, antialiased=False, shade=False)
+    # a decimated mesh instead of two triangles per pixel
+    with profiler.stage("plot3d"):
+        x, y, z, triangles = decimate(noise_array, TRIANGLE_BUDGET, sea_level)
+        surface = ax.plot_trisurf(x, y, z, triangles=triangles, antialiased=False, shade=False)
+        surface.set_facecolor(triangle_colors(color_array, x, y, triangles))
 
     st.pyplot(fig)
 
@@ -106,7 +121,7 @@ def main():
         st.image(color_array, use_column_width=True, channels='RGB')
 
         # Visualize in 3D
-        visualize_3d(noise_array, color_array)
+        visualize_3d(noise_array, color_array, sea_level)
 
 
 if __name__ == "__main__":
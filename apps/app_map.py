@@ -1,50 +1,57 @@
 import streamlit as st
 import numpy as np
+import os
+import sys
 from PIL import Image
 from PIL.Image import fromarray
-import noise
-import time
-
-# for measuring time
-def timing(f):
-    def wrap(*args, **kwargs):
-        time1 = time.time()
-        ret = f(*args, **kwargs)
-        time2 = time.time()
-        print('{:s} function took {:.3f} ms'.format(f.__name__, (time2 - time1) * 1000.0))
-        return ret
-    return wrap
+
+# the terrain engine lives next to the desktop versions in ../Islands
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Islands"))
+from perlin import fractal_noise, tile_noise, OctaveCache
+from palette import palette_for, layers_key
+from pipeline import TerrainPipeline, HeightmapCache, resolve_seed
+from profiling import profiler
+
 
 WHT = "#eeeeee"
 FONT = ("Tahoma", "15")
 FONT2 = ("Tahoma", "8")
 
 class Generator:
-    def __init__(self):
-        pass
+    # workers: processes used by get_random_noise, 1 = serial, None = every core
+    # keep_octaves: keep the last map's octave layers so octave/persistence
+    # edits only compute the difference (serial mode)
+    def __init__(self, workers=1, keep_octaves=False):
+        self.workers = workers
+        self.octave_cache = OctaveCache() if keep_octaves else None
 
     def get_random_noise(self, scale, shape, octaves, persistence, lacunarity, seed=False):
         scale = shape[1] * (scale / 100)
         persistence /= 100
         lacunarity /= 10
-        world = np.zeros(shape)
         if seed == False or seed <= 0:
             seed = np.random.randint(1, 100)
-        for i in range(shape[0]):
-            for j in range(shape[1]):
-                world[i][j] = noise.pnoise2(i / scale, j / scale,
-                                            octaves=octaves,
-                                            persistence=persistence,
-                                            lacunarity=lacunarity,
-                                            base=seed)
+        if self.octave_cache is not None and self.workers == 1:
+            world = self.octave_cache.fractal_noise(shape, scale, octaves, persistence, lacunarity, seed)
+        else:
+            world = fractal_noise(shape, scale, octaves, persistence, lacunarity, seed, workers=self.workers)
         return ((world + 1) * 128).astype(np.uint8)
 
-    def assign_colors(self, layers, noise_array, sea_level):
-        altitudes = (layers[:, 2] + sea_level).astype(int)
-        colors = np.array([np.array([*color], dtype=np.uint8) for color in layers[:, 1]])
-        color_indices = np.digitize(noise_array, altitudes)
-        color_array = np.array([colors[ind] for ind in color_indices])
-        return color_array
+    # tile (tx, ty) of an unbounded world at the given zoom (2**zoom pixels per
+    # world pixel), in the same slider units as get_random_noise; scale is a
+    # percentage of width, so zoom-0 tiles line up with a width-wide map
+    def get_noise_tile(self, tx, ty, zoom, tile_size, scale, width, octaves, persistence, lacunarity, seed):
+        if seed <= 0:
+            raise ValueError("tiles of one world need a fixed seed > 0")
+        scale = width * (scale / 100)
+        persistence /= 100
+        lacunarity /= 10
+        world = tile_noise(tx, ty, zoom, tile_size, scale, octaves, persistence, lacunarity, seed)
+        return ((world + 1) * 128).astype(np.uint8)
+
+    # out: optional uint8 (height, width, 3) buffer to colour into
+    def assign_colors(self, layers, noise_array, sea_level, out=None):
+        return palette_for(layers, sea_level).apply(noise_array, out=out)
 
     def noise_array_to_image(self, noise_world):
         return fromarray(noise_world, mode="L")
@@ -53,11 +60,23 @@ class Generator:
         return fromarray(color_world, mode="RGB")
 
 
+# Shared by every session of this server process: finished maps keyed on the
+# normalized settings, and the heightmaps behind them for colour-only edits
+@st.cache_resource
+def shared_caches():
+    return (
+        HeightmapCache(max_entries=64, max_bytes=512 * 2**20),  # colour maps
+        HeightmapCache(max_entries=32, max_bytes=128 * 2**20),  # heightmaps
+    )
+
+
 class App:
-    def __init__(self, stg, layers):
+    def __init__(self, stg, layers, pipeline=None, maps=None):
         self.stg = stg
         self.layers = layers
         self.gen = Generator()
+        self.pipeline = pipeline if pipeline is not None else TerrainPipeline(self.gen)
+        self.maps = maps if maps is not None else HeightmapCache()
         self.show = True
         self.image = None
 
@@ -74,22 +93,45 @@ class App:
         for key in self.stg:
             self.stg[key][0] = self.stg[key][1]
 
-    @timing
+    def resolved_seed(self):
+        # seed 0 is drawn once per session and again only on "Generate", so
+        # reruns (any widget, the download button) keep the same map, and a
+        # random map is cached under its real seed like any other
+        if self.stg["seed"][0] > 0:
+            return self.stg["seed"][0]
+        if "random_seed" not in st.session_state:
+            st.session_state.random_seed = resolve_seed(0)
+        return st.session_state.random_seed
+
+    def reroll(self):
+        st.session_state.pop("random_seed", None)
+
+    @profiler.profile("generate", report=True)
     def generate(self):
         self.get_inputs()
 
-        noise_array = self.gen.get_random_noise(
-            self.stg["scale"][0], (self.stg["height"][0], self.stg["width"][0]), self.stg["octaves"][0],
-            self.stg["persistence"][0], self.stg["lacunarity"][0],
-            seed=self.stg["seed"][0]
-        )
-        color_array = self.gen.assign_colors(self.layers, noise_array, self.stg["sea_level"][0])
-
-        self.image = self.gen.color_array_to_image(color_array)
+        seed = self.resolved_seed()
+        key = tuple((name, seed if name == "seed" else self.stg[name][0]) for name in sorted(self.stg))
+        key += (layers_key(self.layers),)
+        color_array = self.maps.get(key)
+        if color_array is None:
+            # the heightmap comes from the pipeline's cache when only colours changed
+            with profiler.stage("noise"):
+                noise_array = self.pipeline.heightmap(
+                    (self.stg["height"][0], self.stg["width"][0]), self.stg["scale"][0], self.stg["octaves"][0],
+                    self.stg["persistence"][0], self.stg["lacunarity"][0], seed
+                )
+            with profiler.stage("colors"):
+                color_array = self.pipeline.colors(self.layers, noise_array, self.stg["sea_level"][0])
+            color_array.setflags(write=False)
+            self.maps.put(key, color_array)
+
+        with profiler.stage("image"):
+            self.image = self.gen.color_array_to_image(color_array)
 
     def draw(self):
         st.image(np.array(self.image), use_column_width=True)
-        st.button("Generate", self.generate)
+        st.button("Generate", on_click=self.reroll)
 
         for key in self.stg:
             self.stg[key][0] = st.sidebar.slider(key, self.stg[key][1], self.stg[key][2], self.stg[key][0], 1)
@@ -138,6 +180,13 @@ st.title("MapGen🏞️")
 if "state" not in st.session_state:
     st.session_state.state = stg.copy()
 
-app = App(st.session_state.state, layers)
+maps, heightmaps = shared_caches()
+
+# no per-session octave cache: its layers (tens of MB a session) would sit
+# outside the shared caches' caps, so repeats come from the heightmap cache only
+if "pipeline" not in st.session_state:
+    st.session_state.pipeline = TerrainPipeline(Generator(), cache=heightmaps)
+
+app = App(st.session_state.state, layers, st.session_state.pipeline, maps)
 app.generate()
 app.draw()
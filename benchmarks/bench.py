@@ -0,0 +1,198 @@
+# Benchmarks for the terrain and cave hot paths at several problem sizes.
+#
+#   python benchmarks/bench.py --out baseline.json
+#   python benchmarks/bench.py --baseline baseline.json        # run and compare
+#   python benchmarks/bench.py --baseline old.json --current new.json
+#
+# Every case is run `repeats` times after one warm-up call and reports the
+# best and the median wall time; compare mode flags cases whose best time got
+# more than --threshold slower than the baseline's, and exits with status 1 if
+# any did. The random generators are seeded so every run does the same work.
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, "..", "Islands"))
+sys.path.append(os.path.join(HERE, "..", "Caves"))
+from High_Level_Islands import Generator
+from palette import LAYERS
+import mid_level_cave_system_BFS as caves
+from batched_walk import batchedDrunkenWalk
+from batched_bfs import batchedShortestPaths
+from cellular_caves import cellularAutomata
+
+# (height, width) of the terrain maps
+MAP_SIZES = {
+    "small": (250, 500),
+    "medium": (500, 1000),
+    "large": (1000, 2000),
+}
+# (levelWidth, levelHeight, removeBlocks, amountOfLevels) of the cave levels
+CAVE_SIZES = {
+    "small": (55, 35, 500, 10),
+    "medium": (80, 50, 1000, 10),
+    "large": (110, 70, 2000, 10),
+}
+# levels per batchedDrunkenWalk / batchedShortestPaths / cellularAutomata call
+BATCH_LEVELS = 1000
+# slider units, as in the apps' defaults
+NOISE_SETTINGS = (45, 6, 55, 20)
+SEED = 7
+SEA_LEVEL = 120
+
+
+def measure(fn, repeats):
+    fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {"best": min(times), "median": statistics.median(times), "repeats": repeats}
+
+
+def set_cave_size(width, height, remove_blocks):
+    caves.levelWidth = width
+    caves.levelHeight = height
+    caves.removeBlocks = remove_blocks
+
+
+def terrain_cases(size):
+    gen = Generator()
+    shape = MAP_SIZES[size]
+    scale, octaves, persistence, lacunarity = NOISE_SETTINGS
+    noise_array = gen.get_random_noise(scale, shape, octaves, persistence, lacunarity, seed=SEED)
+    color_array = gen.assign_colors(LAYERS, noise_array, SEA_LEVEL)
+    return {
+        "get_random_noise": lambda: gen.get_random_noise(scale, shape, octaves, persistence, lacunarity, seed=SEED),
+        "assign_colors": lambda: gen.assign_colors(LAYERS, noise_array, SEA_LEVEL),
+        "color_array_to_image": lambda: gen.color_array_to_image(color_array),
+    }
+
+
+def cave_cases(size):
+    width, height, remove_blocks, amount = CAVE_SIZES[size]
+
+    def walk():
+        set_cave_size(width, height, remove_blocks)
+        random.seed(SEED)
+        return caves.drunkenWalkGenerator()
+
+    level, start, end = walk()
+
+    def shortest_path():
+        set_cave_size(width, height, remove_blocks)
+        return caves.getShortestPath(level, start, end)
+
+    def best_level():
+        set_cave_size(width, height, remove_blocks)
+        random.seed(SEED)
+        return caves.generateBestLevel(amount)
+
+    batch = []
+
+    def shortest_paths():
+        # the levels are walked once, on the first (untimed warm-up) call
+        if not batch:
+            batch.extend(batchedDrunkenWalk(BATCH_LEVELS, width, height, remove_blocks, seed=SEED))
+        return batchedShortestPaths(*batch)
+
+    return {
+        "drunkenWalkGenerator": walk,
+        "getShortestPath": shortest_path,
+        "generateBestLevel": best_level,
+        "batchedDrunkenWalk": lambda: batchedDrunkenWalk(BATCH_LEVELS, width, height, remove_blocks, seed=SEED),
+        "batchedShortestPaths": shortest_paths,
+        "cellularAutomata": lambda: cellularAutomata(BATCH_LEVELS, width, height, seed=SEED),
+    }
+
+
+def run(sizes, repeats, only=None, progress=None):
+    results = {}
+    for size in sizes:
+        cases = dict(terrain_cases(size))
+        cases.update(cave_cases(size))
+        for name, fn in cases.items():
+            if only and name not in only:
+                continue
+            key = "{}/{}".format(name, size)
+            results[key] = measure(fn, repeats)
+            if progress is not None:
+                progress(key, results[key])
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "system": platform.system(),
+            "cpus": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold):
+    # -> rows of (case, old best, new best, ratio, regressed)
+    rows = []
+    for key, new in sorted(current["results"].items()):
+        old = baseline["results"].get(key)
+        if old is None:
+            continue
+        ratio = new["best"] / old["best"]
+        rows.append((key, old["best"], new["best"], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the terrain and cave hot paths")
+    parser.add_argument("--sizes", default="small,medium", help="any of small, medium, large")
+    parser.add_argument("--only", default="", help="comma separated case names, default all")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--current", help="compare these stored results instead of running")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown, 0.10 = 10%%")
+    args = parser.parse_args()
+
+    if args.current:
+        with open(args.current) as f:
+            current = json.load(f)
+    else:
+        sizes = [size.strip() for size in args.sizes.split(",")]
+        for size in sizes:
+            if size not in MAP_SIZES:
+                parser.error("unknown size {}".format(size))
+        only = set(name.strip() for name in args.only.split(",") if name.strip())
+
+        def progress(key, result):
+            print("{:<32} best {:10.3f} ms   median {:10.3f} ms".format(
+                key, result["best"] * 1000, result["median"] * 1000))
+
+        current = run(sizes, args.repeats, only, progress)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(current, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(baseline, current, args.threshold)
+        print()
+        for key, old, new, ratio, regressed in rows:
+            print("{:<32} {:10.3f} ms -> {:10.3f} ms  x{:.2f}{}".format(
+                key, old * 1000, new * 1000, ratio, "  REGRESSION" if regressed else ""))
+        if any(row[4] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()